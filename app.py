@@ -6,26 +6,35 @@ import os
 # Load environment variables
 load_dotenv()
 
-# Create the main Flask app
-app = Flask(__name__)
-CORS(app)
-
-# Import routes from scripts
-from scripts import chatbot, disaesePrediction, fitness, insurance, pillRemainder, report, pillIdentifier
-
-# Register routes
-chatbot.register_routes(app)
-disaesePrediction.register_routes(app)
-fitness.register_routes(app)
-insurance.register_routes(app)
-pillRemainder.register_routes(app)
-report.register_routes(app)
-pillIdentifier.register_routes(app)
-
-# Add a root route for testing
-@app.route('/')
-def home():
-    return "Hello from HealthSphere Backend!"
+def create_app():
+    # Create the main Flask app
+    app = Flask(__name__)
+    CORS(app)
+
+    # Import routes from scripts
+    from scripts import chatbot, disaesePrediction, fitness, insurance, pillRemainder, report, pillIdentifier, llmClient
+
+    # Register routes
+    chatbot.register_routes(app)
+    disaesePrediction.register_routes(app)
+    fitness.register_routes(app)
+    insurance.register_routes(app)
+    pillRemainder.register_routes(app)
+    report.register_routes(app)
+    pillIdentifier.register_routes(app)
+    llmClient.register_routes(app)
+
+    # Add a root route for testing
+    @app.route('/')
+    def home():
+        return "Hello from HealthSphere Backend!"
+
+    return app
+
+# Spawned process-pool workers (see reportExtraction) re-run this file as __mp_main__;
+# they must not import the route modules, which start job workers and preload models
+if __name__ != "__mp_main__":
+    app = create_app()
 
 if __name__ == "__main__":
-    app.run(debug=True, host="0.0.0.0", port=5000)
\ No newline at end of file
+    app.run(debug=True, host="0.0.0.0", port=5000)
@@ -1,10 +1,21 @@
 import requests
 import random
+import threading
+import json
+import re
+import queue
+from abc import ABC, abstractmethod
+from concurrent.futures import Future
+from collections import Counter
+from requests.adapters import HTTPAdapter
 from googleapiclient.discovery import build
+import httplib2
+import numpy as np
 import time
 import os
 import logging
 from flask import request, jsonify
+from scripts.resultCache import ResultCache
 
 # Set up logging for debugging on Render
 logging.basicConfig(level=logging.INFO)
@@ -17,11 +28,63 @@ if not HF_API_KEY:
     logger.error("HF_API_KEY not found in environment variables")
 headers = {"Authorization": f"Bearer {HF_API_KEY}"}
 
+# HF request limits: per-attempt connect/read timeouts, and a total budget for all
+# attempts of one detect_mood call, retries and backoff included
+HF_CONNECT_TIMEOUT = float(os.getenv("HF_CONNECT_TIMEOUT", "2"))
+HF_READ_TIMEOUT = float(os.getenv("HF_READ_TIMEOUT", "4"))
+MOOD_DEADLINE_S = float(os.getenv("MOOD_DEADLINE_S", "5"))
+HF_BACKOFF_BASE_S = 0.25
+HF_BACKOFF_CAP_S = 2.0
+HF_RETRY_STATUSES = {429, 503}  # rate limited or model still loading
+
+# Mood backend: "hf" (Hugging Face inference API), "local" (in-process classifier loaded
+# from MOOD_MODEL_DIR; needs the tokenizers and onnxruntime packages from requirements.txt,
+# or tensorflow for a .tflite export) or "keywords" (fallback_rules only). A backend that
+# cannot start falls back to keywords, with the reason logged at startup.
+MOOD_BACKEND = os.getenv("MOOD_BACKEND", "hf")
+MOOD_MODEL_DIR = os.getenv("MOOD_MODEL_DIR", "models/emotion")
+MOOD_MODEL_THREADS = int(os.getenv("MOOD_MODEL_THREADS", "1"))
+
+# Detected moods cached by normalized message (MOOD_CACHE_SIZE entries, 0 disables it)
+MOOD_CACHE_SIZE = int(os.getenv("MOOD_CACHE_SIZE", "4096"))
+MOOD_CACHE_TTL_S = float(os.getenv("MOOD_CACHE_TTL_S", "3600"))
+
+# Concurrent detect_mood calls are grouped for up to MOOD_BATCH_WAIT_MS (at most
+# MOOD_BATCH_MAX_SIZE messages) and classified in one backend call
+MOOD_BATCH_MAX_SIZE = int(os.getenv("MOOD_BATCH_MAX_SIZE", "32"))
+MOOD_BATCH_WAIT_MS = float(os.getenv("MOOD_BATCH_WAIT_MS", "5"))
+MOOD_BATCH_WORKERS = int(os.getenv("MOOD_BATCH_WORKERS", "4"))
+
+# Keep-alive connection pool shared by all chat requests
+hf_session = requests.Session()
+hf_session.headers.update(headers)
+hf_session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=int(os.getenv("HF_POOL_SIZE", "16"))))
+
 # YouTube API setup
 YOUTUBE_API_KEY = os.getenv("YOUTUBE_API_KEY")
 if not YOUTUBE_API_KEY:
     logger.error("YOUTUBE_API_KEY not found in environment variables")
-youtube = build("youtube", "v3", developerKey=YOUTUBE_API_KEY) if YOUTUBE_API_KEY else None
+YOUTUBE_TIMEOUT = float(os.getenv("YOUTUBE_TIMEOUT", "3"))
+youtube_clients = threading.local()
+
+def get_youtube():
+    """Returns this thread's YouTube client; httplib2 connections must not be shared across threads."""
+    if not YOUTUBE_API_KEY:
+        return None
+    client = getattr(youtube_clients, 'client', None)
+    if client is None:
+        client = youtube_clients.client = build(
+            "youtube", "v3", developerKey=YOUTUBE_API_KEY, http=httplib2.Http(timeout=YOUTUBE_TIMEOUT)
+        )
+    return client
+
+# Candidate videos per mood are refreshed in the background every YOUTUBE_POOL_TTL_S
+# seconds, so /chat picks a video without calling the API
+YOUTUBE_POOL_TTL_S = float(os.getenv("YOUTUBE_POOL_TTL_S", "21600"))
+YOUTUBE_POOL_RESULTS = int(os.getenv("YOUTUBE_POOL_RESULTS", "25"))
+# After a failed refresh, /chat does not retry an empty pool inline for this many seconds
+YOUTUBE_RETRY_S = float(os.getenv("YOUTUBE_RETRY_S", "60"))
+FALLBACK_VIDEO_URL = "https://youtube.com/watch?v=dQw4w9WgXcQ"
 
 # Mood-to-query mapping
 mood_queries = {
@@ -60,69 +123,439 @@ fallback_rules = {
     "creepy": "disgust", "off-putting": "disgust"
 }
 
-def detect_mood(text, max_retries=3):
-    if not HF_API_KEY:
-        logger.error("HF_API_KEY is not set, falling back to keyword detection")
-        text = text.lower()
-        for keyword, mood in fallback_rules.items():
-            if keyword in text:
-                logger.info(f"Using fallback: Detected '{keyword}' → {mood}")
-                return mood
-        return "neutral"
+# Byte translation table that keeps letters (including non-ASCII UTF-8 bytes) and turns
+# everything else into a space, so bytes.split() yields whole words
+WORD_BYTES = bytes(c if chr(c).isalpha() or c >= 128 else ord(' ') for c in range(256))
+
+def split_words(text):
+    return text.encode('utf-8').lower().translate(WORD_BYTES).split()
+
+class KeywordMatcher:
+    """Finds whole-word keywords and phrases from a rules dict in a single pass over a message.
+
+    The message is split into words once (in C, via bytes.translate/split). Single-word
+    keywords are found by intersecting its word set with a keyword index; phrases such as
+    "mind-blowing" (which also matches "mind blowing") are checked only where their first
+    word occurs.
+    """
+
+    def __init__(self, rules):
+        self.words = {}
+        self.phrases = {}
+        for keyword, mood in rules.items():
+            words = split_words(keyword)
+            if len(words) == 1:
+                self.words[words[0]] = mood
+            elif words:
+                self.phrases.setdefault(words[0], []).append((tuple(words[1:]), mood))
 
+    def match_moods(self, text):
+        """Returns a Counter of matched moods and the word position of each mood's first match."""
+        words = split_words(text)
+        present = set(words)
+        counts = Counter()
+        first_seen = {}
+
+        def found(mood, position, count=1):
+            counts[mood] += count
+            first_seen[mood] = min(first_seen.get(mood, position), position)
+
+        for word in self.words.keys() & present:
+            found(self.words[word], words.index(word), words.count(word))
+
+        for first in self.phrases.keys() & present:
+            position = words.index(first)
+            while True:
+                for rest, mood in self.phrases[first]:
+                    if tuple(words[position + 1:position + 1 + len(rest)]) == rest:
+                        found(mood, position)
+                try:
+                    position = words.index(first, position + 1)
+                except ValueError:
+                    break
+        return counts, first_seen
+
+# Built once from fallback_rules
+MOOD_MATCHER = KeywordMatcher(fallback_rules)
+
+def keyword_mood(text):
+    """Keyword-based mood: the most frequent matched mood, ties going to the earliest match."""
+    counts, first_seen = MOOD_MATCHER.match_moods(text)
+    if not counts:
+        return "neutral", counts
+    return min(counts, key=lambda m: (-counts[m], first_seen[m])), counts
+
+def fallback_mood(text):
+    mood, counts = keyword_mood(text)
+    logger.info(f"Using fallback: Detected {dict(counts)} → {mood}")
+    return mood
+
+def backoff_delay(attempt):
+    """Full-jitter exponential backoff."""
+    return random.uniform(0, min(HF_BACKOFF_CAP_S, HF_BACKOFF_BASE_S * 2 ** attempt))
+
+def classify_emotions(texts, deadline, max_retries=3):
+    """Returns the top HF emotion label for each text, retrying until `deadline`."""
     for attempt in range(max_retries):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"HF API deadline exceeded after {attempt} attempts")
         try:
-            payload = {"inputs": text}
-            response = requests.post(HF_API_URL, headers=headers, json=payload)
+            payload = {"inputs": texts}
+            response = hf_session.post(HF_API_URL, json=payload,
+                                       timeout=(min(HF_CONNECT_TIMEOUT, remaining), min(HF_READ_TIMEOUT, remaining)))
             if response.status_code == 200:
                 result = response.json()
-                top_mood = max(result[0], key=lambda x: x["score"])["label"]
-                logger.info(f"Detected mood via HF API: {top_mood}")
-                return top_mood
-            else:
-                logger.error(f"HF API Error: {response.status_code} - {response.text}")
-                if response.status_code != 503:  # 503 is temporary, retry
-                    break
-        except Exception as e:
+                if len(result) != len(texts):
+                    raise ValueError(f"HF API returned {len(result)} results for {len(texts)} inputs")
+                return [max(scores, key=lambda x: x["score"])["label"] for scores in result]
+            logger.error(f"HF API Error: {response.status_code} - {response.text}")
+            if response.status_code not in HF_RETRY_STATUSES:
+                raise RuntimeError(f"HF API Error: {response.status_code}")
+        except requests.RequestException as e:
             logger.error(f"Request failed: {e}")
-        time.sleep(2)
+        delay = backoff_delay(attempt)
+        if attempt == max_retries - 1 or time.monotonic() + delay >= deadline:
+            break
+        time.sleep(delay)
+    raise RuntimeError("HF API unavailable")
 
-    # Fallback to keyword-based detection if API fails
-    logger.info("Falling back to keyword-based mood detection")
-    text = text.lower()
-    for keyword, mood in fallback_rules.items():
-        if keyword in text:
-            logger.info(f"Using fallback: Detected '{keyword}' → {mood}")
-            return mood
-    return "neutral"
+class MoodBackend(ABC):
+    """Classifies a batch of messages into mood labels (the keys of mood_queries)."""
 
-def fetch_youtube_video(mood):
-    if not youtube:
-        logger.error("YouTube API not available, returning fallback video")
-        return "https://youtube.com/watch?v=dQw4w9WgXcQ"
+    name = None
 
-    query = mood_queries.get(mood, "interesting videos")
-    try:
-        search_response = youtube.search().list(
-            q=query,
-            part="snippet",
-            maxResults=5,
-            type="video"
-        ).execute()
-        if "items" in search_response and search_response["items"]:
-            video = random.choice(search_response["items"])
-            video_id = video["id"]["videoId"]
-            video_url = f"https://youtube.com/watch?v={video_id}"
-            logger.info(f"Fetched YouTube video: {video_url}")
-            return video_url
+    @abstractmethod
+    def classify(self, texts, deadline, max_retries=3):
+        """Returns one mood label per text, giving up on slow work once `deadline` passes."""
+
+class KeywordMoodBackend(MoodBackend):
+    name = 'keywords'
+
+    def classify(self, texts, deadline=None, max_retries=3):
+        return [keyword_mood(text)[0] for text in texts]
+
+class HFMoodBackend(MoodBackend):
+    name = 'hf'
+
+    def classify(self, texts, deadline, max_retries=3):
+        return classify_emotions(texts, deadline, max_retries)
+
+class LocalMoodBackend(MoodBackend):
+    """In-process CPU emotion classifier.
+
+    `model_dir` holds an exported classifier (model.onnx or model.tflite), the
+    tokenizer.json of its tokenizer and its config.json (id2label, pad_token_id), e.g.
+    j-hartmann/emotion-english-distilroberta-base exported with optimum. Needs the
+    tokenizers package, plus onnxruntime for ONNX models.
+    """
+
+    name = 'local'
+
+    def __init__(self, model_dir, num_threads=1, max_length=128):
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(model_dir, 'config.json')) as f:
+            config = json.load(f)
+        self.labels = [config['id2label'][str(i)].lower() for i in range(len(config['id2label']))]
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, 'tokenizer.json'))
+        self.tokenizer.enable_truncation(max_length)
+        self.tokenizer.enable_padding(pad_id=config.get('pad_token_id', 0))
+
+        onnx_path = os.path.join(model_dir, 'model.onnx')
+        tflite_path = os.path.join(model_dir, 'model.tflite')
+        if os.path.exists(onnx_path):
+            import onnxruntime
+
+            options = onnxruntime.SessionOptions()
+            options.intra_op_num_threads = num_threads
+            self.session = onnxruntime.InferenceSession(onnx_path, options, providers=['CPUExecutionProvider'])
+            self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+            self.run = self._run_onnx
+        elif os.path.exists(tflite_path):
+            import tensorflow.lite as tflite
+
+            self.interpreter = tflite.Interpreter(model_path=tflite_path, num_threads=num_threads)
+            self.interpreter.allocate_tensors()
+            self.interpreter_lock = threading.Lock()
+            self.run = self._run_tflite
         else:
-            logger.warning("No YouTube videos found, returning fallback video")
-            return "https://youtube.com/watch?v=dQw4w9WgXcQ"
+            raise FileNotFoundError(f"No model.onnx or model.tflite in {model_dir}")
+        logger.info(f"Loaded local mood classifier from {model_dir}")
+
+    def encode(self, texts):
+        """Tokenizes a batch, padded to its longest message."""
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+        attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+        return {'input_ids': input_ids, 'attention_mask': attention_mask}
+
+    def _run_onnx(self, feeds):
+        return self.session.run(None, {name: feeds[name] for name in self.input_names})[0]
+
+    def _run_tflite(self, feeds):
+        with self.interpreter_lock:
+            inputs = self.interpreter.get_input_details()
+            named = [(detail, feeds['input_ids' if 'input_ids' in detail['name'] else 'attention_mask'])
+                     for detail in inputs]
+            if any(tuple(detail['shape']) != value.shape for detail, value in named):
+                for detail, value in named:
+                    self.interpreter.resize_tensor_input(detail['index'], value.shape)
+                self.interpreter.allocate_tensors()
+            for detail, value in named:
+                self.interpreter.set_tensor(detail['index'], value.astype(detail['dtype'], copy=False))
+            self.interpreter.invoke()
+            return self.interpreter.get_tensor(self.interpreter.get_output_details()[0]['index']).copy()
+
+    def classify(self, texts, deadline=None, max_retries=3):
+        logits = self.run(self.encode(texts))
+        return [self.labels[i] for i in np.argmax(logits, axis=-1)]
+
+def create_mood_backend(name):
+    if name == 'local':
+        try:
+            return LocalMoodBackend(MOOD_MODEL_DIR, MOOD_MODEL_THREADS)
+        except Exception as e:
+            logger.error(f"Local mood classifier unavailable ({e}), falling back to keyword detection")
+            return KeywordMoodBackend()
+    if name == 'hf':
+        if not HF_API_KEY:
+            logger.error("HF_API_KEY is not set, falling back to keyword detection")
+            return KeywordMoodBackend()
+        return HFMoodBackend()
+    if name != 'keywords':
+        logger.error(f"Unknown MOOD_BACKEND {name}, falling back to keyword detection")
+    return KeywordMoodBackend()
+
+class MoodBatcher:
+    """Groups concurrent mood requests into batched backend calls."""
+
+    def __init__(self, backend, max_batch_size, max_wait_ms, num_workers):
+        self.backend = backend
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.pending = queue.Queue()
+        for i in range(max(1, num_workers)):
+            threading.Thread(target=self._run, name=f"mood-batch-{i}", daemon=True).start()
+
+    def submit(self, text, deadline, max_retries=3):
+        """Queues a message and returns a Future for its mood label."""
+        future = Future()
+        self.pending.put((text, deadline, max_retries, future))
+        return future
+
+    def _collect(self):
+        items = [self.pending.get()]
+        wait_until = time.monotonic() + self.max_wait
+        while len(items) < self.max_batch_size:
+            remaining = wait_until - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self.pending.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def _run(self):
+        while True:
+            # Callers whose deadline already passed have given up; don't spend a request on them
+            items = [item for item in self._collect() if item[1] > time.monotonic()]
+            if not items:
+                continue
+            try:
+                moods = self.backend.classify(
+                    [text for text, _, _, _ in items],
+                    max(deadline for _, deadline, _, _ in items),
+                    max(retries for _, _, retries, _ in items)
+                )
+                logger.info("Classified %d messages in one %s call", len(items), self.backend.name)
+                for (_, _, _, future), mood in zip(items, moods):
+                    future.set_result(mood)
+            except Exception as e:
+                for _, _, _, future in items:
+                    future.set_exception(e)
+
+mood_backend = create_mood_backend(MOOD_BACKEND)
+mood_batcher = MoodBatcher(mood_backend, MOOD_BATCH_MAX_SIZE, MOOD_BATCH_WAIT_MS, MOOD_BATCH_WORKERS)
+
+mood_cache = ResultCache(MOOD_CACHE_SIZE, MOOD_CACHE_TTL_S or None)
+
+NON_WORD_PATTERN = re.compile(r"[\W_]+")
+
+def normalize_message(text):
+    """Case-folds a message and collapses whitespace and punctuation, e.g. "I'm  STRESSED!!" -> "i m stressed"."""
+    return NON_WORD_PATTERN.sub(" ", text.casefold()).strip()
+
+def detect_mood(text, max_retries=3, budget=None):
+    if mood_backend.name == 'keywords':
+        return fallback_mood(text)
+
+    cache_key = normalize_message(text)
+    cached_mood = mood_cache.get(cache_key) if cache_key else None
+    if cached_mood is not None:
+        logger.info(f"Detected mood from cache: {cached_mood}")
+        return cached_mood
+
+    deadline = time.monotonic() + (MOOD_DEADLINE_S if budget is None else budget)
+    try:
+        # The caller's own deadline holds even if the batch it joined runs longer
+        top_mood = mood_batcher.submit(text, deadline, max_retries).result(
+            timeout=max(0.0, deadline - time.monotonic())
+        )
+        logger.info(f"Detected mood via {mood_backend.name} backend: {top_mood}")
+        if cache_key:
+            mood_cache.put(cache_key, top_mood)
+        return top_mood
     except Exception as e:
-        logger.error(f"YouTube API Error: {e}")
-        return "https://youtube.com/watch?v=dQw4w9WgXcQ"
+        logger.error(f"{mood_backend.name} mood detection failed: {e!r}")
+
+    # Fallback to keyword-based detection if the backend fails
+    logger.info("Falling back to keyword-based mood detection")
+    return fallback_mood(text)
+
+def search_youtube_videos(mood):
+    """Returns the video IDs the YouTube API finds for a mood's query."""
+    youtube = get_youtube()
+    if not youtube:
+        raise RuntimeError("YouTube API not available")
+    query = mood_queries.get(mood, "interesting videos")
+    search_response = youtube.search().list(
+        q=query,
+        part="snippet",
+        maxResults=YOUTUBE_POOL_RESULTS,
+        type="video"
+    ).execute()
+    return [item["id"]["videoId"] for item in search_response.get("items", [])]
+
+class VideoPool:
+    """Per-mood candidate video IDs, refreshed on a TTL and kept when a refresh fails."""
+
+    def __init__(self, moods, ttl_seconds, retry_seconds=60):
+        self.ttl = ttl_seconds
+        self.retry_seconds = retry_seconds
+        self.lock = threading.Lock()
+        # Futures for inline refreshes in progress, keyed by mood
+        self.in_flight = {}
+        self.pools = {
+            mood: {'videos': [], 'refreshed_at': None, 'refreshes': 0, 'failures': 0,
+                   'last_error': None, 'failed_at': None, 'last_refresh_s': None}
+            for mood in moods
+        }
+
+    def refresh(self, mood):
+        start = time.monotonic()
+        try:
+            videos = search_youtube_videos(mood)
+            if not videos:
+                raise RuntimeError("no videos found")
+        except Exception as e:
+            with self.lock:
+                pool = self.pools[mood]
+                pool['failures'] += 1
+                pool['last_error'] = str(e)
+                pool['failed_at'] = time.monotonic()
+            logger.error(f"YouTube refresh for {mood} failed, keeping {len(self.pools[mood]['videos'])} stale videos: {e}")
+            return False
+        with self.lock:
+            pool = self.pools[mood]
+            pool.update({'videos': videos, 'refreshed_at': time.time(), 'last_error': None, 'failed_at': None,
+                         'last_refresh_s': time.monotonic() - start})
+            pool['refreshes'] += 1
+        logger.info(f"Refreshed {len(videos)} YouTube videos for {mood}")
+        return True
+
+    def fill(self, mood):
+        """Refreshes `mood` inline for a request that found its pool empty.
+
+        Concurrent callers share one refresh per mood, and none is attempted while the
+        last failure is younger than retry_seconds. Returns whether the refresh succeeded.
+        """
+        with self.lock:
+            failed_at = self.pools[mood]['failed_at']
+            if failed_at is not None and time.monotonic() - failed_at < self.retry_seconds:
+                return False
+            future = self.in_flight.get(mood)
+            owner = future is None
+            if owner:
+                future = self.in_flight[mood] = Future()
+        if not owner:
+            return future.result()
+        refreshed = False
+        try:
+            refreshed = self.refresh(mood)
+        finally:
+            with self.lock:
+                del self.in_flight[mood]
+            future.set_result(refreshed)
+        return refreshed
+
+    def is_stale(self, mood):
+        refreshed_at = self.pools[mood]['refreshed_at']
+        return refreshed_at is None or time.time() - refreshed_at >= self.ttl
+
+    def pick(self, mood):
+        """Returns a random pooled video URL for `mood`, or None if its pool is empty."""
+        mood = mood if mood in self.pools else "neutral"
+        with self.lock:
+            videos = self.pools[mood]['videos']
+            video_id = random.choice(videos) if videos else None
+        return f"https://youtube.com/watch?v={video_id}" if video_id else None
+
+    def run(self, interval=60):
+        while True:
+            for mood in self.pools:
+                if self.is_stale(mood):
+                    self.refresh(mood)
+            time.sleep(interval)
+
+    def start(self):
+        threading.Thread(target=self.run, name="youtube-pool", daemon=True).start()
+
+    def stats(self):
+        with self.lock:
+            return {
+                mood: {
+                    'videos': len(pool['videos']),
+                    'age_s': time.time() - pool['refreshed_at'] if pool['refreshed_at'] else None,
+                    'refreshes': pool['refreshes'],
+                    'failures': pool['failures'],
+                    'last_error': pool['last_error'],
+                    'last_refresh_s': pool['last_refresh_s']
+                }
+                for mood, pool in self.pools.items()
+            }
+
+video_pool = VideoPool(mood_queries, YOUTUBE_POOL_TTL_S, YOUTUBE_RETRY_S)
+
+def fetch_youtube_video(mood):
+    video_url = video_pool.pick(mood)
+    if video_url is None and get_youtube():
+        # Nothing pooled yet (e.g. right after startup): fill this mood inline, shared with
+        # concurrent requests and skipped while a recent refresh failure backs off
+        video_pool.fill(mood if mood in mood_queries else "neutral")
+        video_url = video_pool.pick(mood)
+    if video_url is None:
+        logger.warning("No YouTube videos available, returning fallback video")
+        return FALLBACK_VIDEO_URL
+    logger.info(f"Picked YouTube video: {video_url}")
+    return video_url
 
 def register_routes(app):
+    if get_youtube():
+        video_pool.start()
+    else:
+        logger.error("YouTube API not available, chat will return the fallback video")
+
+    @app.route('/chat/metrics', methods=['GET'])
+    def chat_metrics():
+        return jsonify({
+            "mood_backend": mood_backend.name,
+            "mood_cache": mood_cache.stats(),
+            "video_pools": video_pool.stats()
+        })
+
     @app.route('/chat', methods=['POST'])
     def chat_endpoint():
         data = request.get_json()
@@ -1,25 +1,42 @@
 import os
 os.environ["CUDA_VISIBLE_DEVICES"] = ""  # Disable GPU usage
 import numpy as np
-import tensorflow as tf
-import tensorflow.lite as tflite
-from tensorflow.keras.preprocessing.image import load_img, img_to_array
-from tensorflow.keras.models import load_model
-import gdown
+# TensorFlow is imported by the model loaders, so web workers that hand inference
+# to a model server (see scripts/modelServer.py) never load it
 import logging
-import requests
 import gc
+import io
 import psutil
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from PIL import Image
 from flask import request, jsonify
+from scripts.modelServer import ModelServerClient, configured_addresses
+from scripts.modelStore import ModelStore
+from scripts.resultCache import ResultCache, content_hash
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Directory to store models in the backend
-MODEL_DIR = "models"
+MODEL_DIR = os.getenv("MODEL_DIR", "models")
 os.makedirs(MODEL_DIR, exist_ok=True)
 
+# Expected SHA-256 and size of model files pinned with the code. Files without a pin are
+# recorded in MODEL_MANIFEST_PATH on their first verified fetch, unless MODEL_REQUIRE_PINS
+# is set, which refuses downloadable files that are not pinned. MODEL_SOURCE_DIR fetches
+# files from a local directory rather than the URLs below (e.g. for offline testing).
+MODEL_PINNED_MANIFEST_PATH = os.getenv("MODEL_PINNED_MANIFEST_PATH",
+                                       os.path.join(os.path.dirname(os.path.abspath(__file__)), "modelManifest.json"))
+MODEL_MANIFEST_PATH = os.getenv("MODEL_MANIFEST_PATH", os.path.join(MODEL_DIR, "manifest.json"))
+MODEL_REQUIRE_PINS = os.getenv("MODEL_REQUIRE_PINS", "false").lower() in ("1", "true", "yes")
+MODEL_SOURCE_DIR = os.getenv("MODEL_SOURCE_DIR")
+
 # Dictionary of model names and their Google Drive direct download links
 MODEL_URLS = {
     "Brain_tumor_best_model.h5": "https://drive.google.com/uc?id=1UEr3hcVzzh98yftpKyam57R9dgvvgU3K",
@@ -37,84 +54,319 @@ MODEL_FILES = {
     'brain': {'file': 'Brain_tumor_best_model.h5', 'type': 'h5'}
 }
 
-# Cache for loaded models
-MODEL_CACHE = {}
+# Approximate memory budget for loaded models in MB (0 = unlimited). When loading a model
+# would exceed it, the least recently used models are evicted first.
+MODEL_CACHE_BUDGET_MB = float(os.getenv("MODEL_CACHE_BUDGET_MB", "0"))
+MODEL_LOAD_LOCKS = {model_type: threading.Lock() for model_type in MODEL_FILES}
+
+# TFLite interpreter pool settings. Each pooled interpreter runs with TFLITE_NUM_THREADS
+# intra-op threads, and by default the pool holds enough interpreters to cover every core.
+TFLITE_NUM_THREADS = max(1, int(os.getenv("TFLITE_NUM_THREADS", "1")))
+TFLITE_POOL_SIZE = int(os.getenv("TFLITE_POOL_SIZE", "0")) or max(1, (os.cpu_count() or 1) // TFLITE_NUM_THREADS)
+TFLITE_USE_XNNPACK = os.getenv("TFLITE_USE_XNNPACK", "true").lower() in ("1", "true", "yes")
+
+# Out-of-process inference: when MODEL_SERVER_ADDRESS is set, models live in the model
+# server and this process only preprocesses images. MODEL_SERVER_FALLBACK_LOCAL=true lets
+# a worker load the models itself if the server cannot be reached.
+MODEL_SERVER_CLIENT = ModelServerClient(configured_addresses()) if configured_addresses() else None
+MODEL_SERVER_FALLBACK_LOCAL = os.getenv("MODEL_SERVER_FALLBACK_LOCAL", "false").lower() in ("1", "true", "yes")
+
+# Models to load and warm up in the background at startup: a comma-separated list of
+# model types or "all". Empty (the default) keeps lazy loading on first request.
+PRELOAD_MODELS = os.getenv("PRELOAD_MODELS", "")
+
+# Per-model readiness reported by /health
+MODEL_STATUS = {model_type: {'state': 'not_loaded'} for model_type in MODEL_FILES}
+
+# Cache of raw predictions keyed by (model type, model file hash, image content hash).
+# PREDICTION_CACHE_SIZE bounds the in-memory tier (0 disables it); PREDICTION_CACHE_DIR
+# adds an on-disk tier of at most PREDICTION_CACHE_MAX_DISK_ENTRIES files. Both expire
+# entries after PREDICTION_CACHE_TTL_S seconds.
+PREDICTION_CACHE = ResultCache(
+    int(os.getenv("PREDICTION_CACHE_SIZE", "1024")),
+    float(os.getenv("PREDICTION_CACHE_TTL_S", "86400")) or None,
+    os.getenv("PREDICTION_CACHE_DIR"),
+    int(os.getenv("PREDICTION_CACHE_MAX_DISK_ENTRIES", "20000"))
+)
+
+# Micro-batching settings. PREDICT_BATCH_MAX_SIZE / PREDICT_BATCH_MAX_WAIT_MS apply to
+# every model type and can be overridden per type, e.g. PREDICT_BATCH_MAX_SIZE_CHEST=16.
+# A larger batch or wait window raises throughput at the cost of per-request latency.
+DEFAULT_BATCH_MAX_SIZE = 8
+DEFAULT_BATCH_MAX_WAIT_MS = 10.0
+
+# One batch scheduler per model type, created on first use
+BATCH_SCHEDULERS = {}
+BATCH_SCHEDULERS_LOCK = threading.Lock()
+
+def current_rss():
+    return psutil.Process(os.getpid()).memory_info().rss
 
 # Function to log memory usage
 def log_memory_usage():
-    process = psutil.Process(os.getpid())
-    mem_info = process.memory_info()
-    memory_mb = mem_info.rss / (1024 * 1024)  # Convert bytes to MB
+    memory_mb = current_rss() / (1024 * 1024)  # Convert bytes to MB
     logger.info(f"Current memory usage: {memory_mb:.2f} MB")
 
-# Check if Google Drive link is accessible
-def is_url_accessible(url):
-    try:
-        response = requests.head(url, allow_redirects=True, timeout=10)
-        return response.status_code == 200
-    except Exception as e:
-        logger.error(f"Failed to access URL {url}: {str(e)}")
-        return False
+class ModelCache:
+    """LRU cache of loaded models kept within an approximate memory budget.
+
+    A model's footprint is the RSS growth measured while loading it (at least its file
+    size), plus what charge() adds as its interpreter pool grows or an interpreter's
+    arena is reallocated for a larger batch. It is an estimate; concurrent loads of
+    other models can inflate it.
+    """
+
+    def __init__(self, budget_mb):
+        self.budget = int(budget_mb * 1024 * 1024)
+        self.entries = OrderedDict()
+        # Footprints are remembered after eviction to plan room for a reload
+        self.footprints = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.load_times = {}
+
+    def get(self, model_type):
+        with self.lock:
+            model_data = self.entries.get(model_type)
+            if model_data is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(model_type)
+            self.hits += 1
+            return model_data
+
+    def _used(self):
+        return sum(self.footprints.get(model_type, 0) for model_type in self.entries)
+
+    def _evict_for(self, model_type, needed):
+        while self.budget and self.entries and self._used() + needed > self.budget:
+            victim = next((t for t in self.entries if t != model_type), None)
+            if victim is None:
+                break
+            del self.entries[victim]
+            self.evictions += 1
+            logger.info("Evicted %s model (%.1f MB) to stay within the %.1f MB model budget",
+                        victim, self.footprints.get(victim, 0) / (1024 * 1024), self.budget / (1024 * 1024))
+
+    def make_room(self, model_type, model_path):
+        """Evicts least recently used models so `model_type` is expected to fit."""
+        with self.lock:
+            needed = self.footprints.get(model_type) or os.path.getsize(model_path)
+            before = len(self.entries)
+            self._evict_for(model_type, needed)
+            evicted = before - len(self.entries)
+        if evicted:
+            gc.collect()
+
+    def put(self, model_type, model_data, footprint, load_time):
+        with self.lock:
+            self.entries[model_type] = model_data
+            self.entries.move_to_end(model_type)
+            self.footprints[model_type] = footprint
+            self.load_times[model_type] = load_time
+            if self._used() > self.budget > 0:
+                logger.warning("Model cache is over budget after loading %s", model_type)
+            self._evict_for(model_type, 0)
+
+    def charge(self, model_type, nbytes):
+        """Adds memory a loaded model has grown by to its footprint, evicting other models to stay in budget."""
+        if nbytes <= 0:
+            return
+        with self.lock:
+            if model_type not in self.entries:
+                return
+            self.footprints[model_type] = self.footprints.get(model_type, 0) + nbytes
+            before = len(self.entries)
+            self._evict_for(model_type, 0)
+            evicted = before - len(self.entries)
+        if evicted:
+            gc.collect()
+
+    def items(self):
+        with self.lock:
+            return list(self.entries.items())
+
+    def stats(self):
+        with self.lock:
+            return {
+                'budget_mb': self.budget / (1024 * 1024),
+                'used_mb': self._used() / (1024 * 1024),
+                'loaded': list(self.entries),
+                'footprints_mb': {t: size / (1024 * 1024) for t, size in self.footprints.items()},
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'load_times_s': dict(self.load_times)
+            }
+
+# Quantized variants of each model type. 'float32' is the original file in MODEL_FILES;
+# pick another per model type with MODEL_VARIANT_<TYPE>, e.g. MODEL_VARIANT_BRAIN=float16.
+# Variant files have no download URL: put them in MODEL_DIR or MODEL_SOURCE_DIR, or build
+# the brain variants with `python -m scripts.modelBenchmark convert`.
+MODEL_VARIANTS = {
+    'eye': {'float16': 'Vgg16(2)_float16.tflite', 'int8': 'Vgg16(2)_int8.tflite'},
+    'chest': {'float16': 'chest_xray_model_float16.tflite', 'int8': 'chest_xray_model_int8.tflite'},
+    'brain': {'float16': 'Brain_tumor_best_model_float16.tflite', 'int8': 'Brain_tumor_best_model_int8.tflite'}
+}
+
+def selected_variant(model_type):
+    variant = os.getenv(f"MODEL_VARIANT_{model_type.upper()}", "float32")
+    if variant != 'float32' and variant not in MODEL_VARIANTS[model_type]:
+        logger.warning("Unknown %s model variant %s; using float32", model_type, variant)
+        return 'float32'
+    return variant
+
+MODEL_VARIANT_SELECTION = {model_type: selected_variant(model_type) for model_type in MODEL_FILES}
+
+def model_info_for(model_type, variant=None):
+    """File and format of the configured (or given) variant of a model type."""
+    variant = variant or MODEL_VARIANT_SELECTION[model_type]
+    if variant == 'float32':
+        return MODEL_FILES[model_type]
+    return {'file': MODEL_VARIANTS[model_type][variant], 'type': 'tflite'}
+
+# Cache for loaded models
+MODEL_CACHE = ModelCache(MODEL_CACHE_BUDGET_MB)
+
+# Verified local copies of the model files
+MODEL_STORE = ModelStore(MODEL_DIR, MODEL_URLS, MODEL_MANIFEST_PATH, MODEL_SOURCE_DIR,
+                         MIN_MODEL_SIZE_MB * 1024 * 1024, MODEL_PINNED_MANIFEST_PATH, MODEL_REQUIRE_PINS)
 
 # Download a model if it doesn’t exist locally
 def download_model(model_name):
-    model_path = os.path.join(MODEL_DIR, model_name)
-    if os.path.exists(model_path):
-        file_size = os.path.getsize(model_path) / (1024 * 1024)  # Size in MB
-        if file_size < MIN_MODEL_SIZE_MB:
-            logger.info(f"Removing small file {model_name} ({file_size:.2f} MB)")
-            os.remove(model_path)
-    
-    if not os.path.exists(model_path):
-        url = MODEL_URLS.get(model_name)
-        if not url:
-            logger.error(f"No URL found for {model_name}")
-            raise ValueError(f"No URL found for {model_name}")
-        if not is_url_accessible(url):
-            logger.error(f"Google Drive URL for {model_name} is not accessible")
-            raise ValueError(f"Google Drive URL for {model_name} is not accessible")
-        logger.info(f"Downloading {model_name} from {url}...")
-        try:
-            gdown.download(url, model_path, quiet=False, fuzzy=True)
-            file_size = os.path.getsize(model_path) / (1024 * 1024)  # Size in MB
-            logger.info(f"Successfully downloaded {model_name} (Size: {file_size:.2f} MB)")
-            if file_size < MIN_MODEL_SIZE_MB:
-                logger.error(f"Downloaded file {model_name} is too small ({file_size:.2f} MB)")
-                os.remove(model_path)
-                raise ValueError(f"Downloaded file {model_name} is too small")
-        except Exception as e:
-            logger.error(f"Failed to download {model_name}: {str(e)}")
-            raise
-    return model_path
+    """Returns the verified local path of a model file; only the first call per file does any I/O."""
+    return MODEL_STORE.path(model_name)
 
-# Load model based on type
-def load_model_for_type(model_type):
-    if model_type not in MODEL_FILES:
-        raise ValueError(f"Invalid model type: {model_type}")
+class InterpreterPool:
+    """Pool of TFLite interpreters for one model file, grown lazily up to `size` instances.
 
-    model_info = MODEL_FILES[model_type]
-    model_name = model_info['file']
-    model_path = download_model(model_name)
+    A single tflite.Interpreter is not safe to share between threads, so each inference
+    checks one out exclusively and returns it when done.
+    """
 
-    if model_type in MODEL_CACHE:
-        logger.info(f"Using cached model for {model_type}")
-        return MODEL_CACHE[model_type]
+    def __init__(self, model_type, model_path, size, num_threads, use_xnnpack):
+        self.model_type = model_type
+        self.model_path = model_path
+        self.size = max(1, size)
+        self.num_threads = num_threads
+        self.use_xnnpack = use_xnnpack
+        self.idle = []
+        self.created = 0
+        self.available = threading.Condition()
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        # Create the first interpreter up front so a broken model file fails at load time
+        self.idle.append(self._create())
+        self.created = 1
 
-    if model_info['type'] == 'h5':
-        logger.info(f"Loading .h5 model for {model_type} from {model_path}...")
-        model = load_model(model_path)
-        MODEL_CACHE[model_type] = {'type': 'h5', 'model': model}
-    else:  # tflite
-        logger.info(f"Loading .tflite model for {model_type} from {model_path}...")
-        interpreter = tflite.Interpreter(model_path=model_path)
+    def _create(self):
+        import tensorflow.lite as tflite
+
+        # Loading by path lets TFLite memory-map the verified file, so pooled interpreters
+        # share the model's pages instead of each holding a copy
+        kwargs = {'model_path': self.model_path, 'num_threads': self.num_threads}
+        if not self.use_xnnpack:
+            kwargs['experimental_op_resolver_type'] = tflite.experimental.OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES
+        interpreter = tflite.Interpreter(**kwargs)
         interpreter.allocate_tensors()
-        MODEL_CACHE[model_type] = {
-            'type': 'tflite',
+        return {
             'interpreter': interpreter,
             'input_details': interpreter.get_input_details(),
             'output_details': interpreter.get_output_details()
         }
-    return MODEL_CACHE[model_type]
+
+    @contextmanager
+    def checkout(self):
+        """Yields an interpreter slot for exclusive use, blocking while all are busy."""
+        start = time.monotonic()
+        slot = None
+        with self.available:
+            while not self.idle and self.created >= self.size:
+                self.available.wait()
+            if self.idle:
+                slot = self.idle.pop()
+            else:
+                self.created += 1
+            waited = time.monotonic() - start
+            self.checkouts += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+
+        if slot is None:
+            try:
+                rss_before = current_rss()
+                slot = self._create()
+                # The first interpreter is measured by load_model_for_type; later ones are charged here
+                MODEL_CACHE.charge(self.model_type, current_rss() - rss_before)
+                logger.info("Created interpreter %d/%d for %s", self.created, self.size, self.model_type)
+            except Exception:
+                with self.available:
+                    self.created -= 1
+                    self.available.notify()
+                raise
+
+        try:
+            yield slot
+        finally:
+            with self.available:
+                self.idle.append(slot)
+                self.available.notify()
+
+    def stats(self):
+        with self.available:
+            return {
+                'size': self.size,
+                'created': self.created,
+                'in_use': self.created - len(self.idle),
+                'num_threads': self.num_threads,
+                'xnnpack': self.use_xnnpack,
+                'checkouts': self.checkouts,
+                'avg_wait_ms': (self.total_wait / self.checkouts * 1000) if self.checkouts else 0.0,
+                'max_wait_ms': self.max_wait * 1000
+            }
+
+def build_model(model_type, model_info, model_path, pool_size):
+    if model_info['type'] == 'h5':
+        from tensorflow.keras.models import load_model
+
+        logger.info(f"Loading .h5 model for {model_type} from {model_path}...")
+        return {'type': 'h5', 'model': load_model(model_path)}
+
+    logger.info(f"Loading .tflite model for {model_type} from {model_path}...")
+    pool = InterpreterPool(model_type, model_path, pool_size, TFLITE_NUM_THREADS, TFLITE_USE_XNNPACK)
+    return {'type': 'tflite', 'pool': pool}
+
+# Load model based on type
+def load_model_for_type(model_type):
+    if model_type not in MODEL_FILES:
+        raise ValueError(f"Invalid model type: {model_type}")
+
+    with MODEL_LOAD_LOCKS[model_type]:
+        model_data = MODEL_CACHE.get(model_type)
+        if model_data is not None:
+            return model_data
+
+        model_info = model_info_for(model_type)
+        model_name = model_info['file']
+        model_path = download_model(model_name)
+
+        MODEL_CACHE.make_room(model_type, model_path)
+        rss_before = current_rss()
+        start = time.monotonic()
+        model_data = build_model(model_type, model_info, model_path, TFLITE_POOL_SIZE)
+        load_time = time.monotonic() - start
+        footprint = max(current_rss() - rss_before, os.path.getsize(model_path))
+        logger.info("Loaded %s model in %.2fs (~%.1f MB)", model_type, load_time, footprint / (1024 * 1024))
+        MODEL_CACHE.put(model_type, model_data, footprint, load_time)
+        return model_data
+
+def inference_workers(model_type):
+    """Number of batches that may run concurrently for a model type."""
+    # Keras models already parallelise a batch internally; TFLite scales with the pool
+    return TFLITE_POOL_SIZE if model_info_for(model_type)['type'] == 'tflite' else 1
 
 # Labels and image sizes for each model type
 labels = {
@@ -132,28 +384,337 @@ image_sizes = {
     'brain': (150, 150)
 }
 
-def preprocess_image(image_path, model_type):
-    """Loads and preprocesses image for model prediction."""
+# Per-thread input buffers, one (n, height, width, 3) float32 array per model type
+INPUT_BUFFERS = threading.local()
+
+def get_input_buffer(model_type, count=1):
+    """Returns this thread's input buffer for `count` images, growing it when needed."""
+    buffers = getattr(INPUT_BUFFERS, 'buffers', None)
+    if buffers is None:
+        buffers = INPUT_BUFFERS.buffers = {}
+    if model_type not in buffers or buffers[model_type].shape[0] < count:
+        height, width = image_sizes[model_type]
+        buffers[model_type] = np.empty((count, height, width, 3), dtype=np.float32)
+    return buffers[model_type][:count]
+
+def preprocess_image(image_stream, model_type, out=None):
+    """Decodes an uploaded image in memory and writes the model input into `out`."""
     try:
-        img = load_img(image_path, target_size=image_sizes[model_type], color_mode='rgb')
-        img = img_to_array(img)
-        img = np.expand_dims(img, axis=0)
+        height, width = image_sizes[model_type]
+        if out is None:
+            out = np.empty((1, height, width, 3), dtype=np.float32)
+        with Image.open(image_stream) as img:
+            # Nearest-neighbour matches the Keras load_img default the models were validated with
+            img = img.convert('RGB').resize((width, height), Image.NEAREST)
+            np.copyto(out[0], np.asarray(img), casting='unsafe')
         # Apply normalization only for eye and chest (.tflite models)
         # Do NOT normalize for brain (.h5 model) as per original working code
         if model_type in ['eye', 'chest']:
-            img = img / 255.0  # Normalize to [0, 1] for .tflite models
-        return img
+            out *= 1.0 / 255.0  # Normalize to [0, 1] for .tflite models
+        return out
     except Exception as e:
         logger.error("Error preprocessing image for %s: %s", model_type, str(e))
         raise
 
+def batch_setting(name, model_type, default, cast):
+    """Reads a batching setting, preferring the per-model-type override."""
+    value = os.getenv(f"PREDICT_BATCH_{name}_{model_type.upper()}") or os.getenv(f"PREDICT_BATCH_{name}")
+    if value is None:
+        return default
+    try:
+        return cast(value)
+    except ValueError:
+        logger.warning("Ignoring invalid PREDICT_BATCH_%s value for %s: %s", name, model_type, value)
+        return default
+
+# Run a single forward pass over a stacked batch of preprocessed images
+def run_inference(model_type, batch):
+    return run_model(model_type, load_model_for_type(model_type), batch)
+
+def run_model(model_type, model_data, batch):
+    if model_data['type'] == 'h5':
+        return np.asarray(model_data['model'].predict_on_batch(batch))
+
+    with model_data['pool'].checkout() as slot:
+        return run_tflite(model_type, slot, batch)
+
+def quantize_input(detail, batch):
+    """Converts a float batch to the interpreter's input type, applying int8/uint8 quantization."""
+    dtype = detail['dtype']
+    scale, zero_point = detail['quantization']
+    if np.issubdtype(dtype, np.integer) and scale:
+        limits = np.iinfo(dtype)
+        return np.clip(np.round(batch / scale + zero_point), limits.min, limits.max).astype(dtype)
+    return batch.astype(dtype, copy=False)
+
+def dequantize_output(detail, output):
+    scale, zero_point = detail['quantization']
+    if np.issubdtype(output.dtype, np.integer) and scale:
+        return (output.astype(np.float32) - zero_point) * scale
+    return output.copy()
+
+def run_tflite(model_type, slot, batch):
+    interpreter = slot['interpreter']
+    input_detail = slot['input_details'][0]
+    output_detail = slot['output_details'][0]
+    output_index = output_detail['index']
+    batch = quantize_input(input_detail, batch)
+
+    # TFLite inputs have a fixed shape; resize only when the batch size changes
+    if slot.get('batchable', True) and tuple(interpreter.get_input_details()[0]['shape']) != batch.shape:
+        try:
+            rss_before = current_rss()
+            interpreter.resize_tensor_input(input_detail['index'], batch.shape)
+            interpreter.allocate_tensors()
+            # The arena only needs charging the first time this interpreter reaches a batch size
+            if batch.shape[0] > slot.get('arena_batch', 1):
+                slot['arena_batch'] = batch.shape[0]
+                MODEL_CACHE.charge(model_type, current_rss() - rss_before)
+        except Exception as e:
+            logger.warning("Model %s does not accept batched input (%s); running images one by one",
+                           model_type, str(e))
+            slot['batchable'] = False
+            interpreter.resize_tensor_input(input_detail['index'], (1,) + batch.shape[1:])
+            interpreter.allocate_tensors()
+
+    if not slot.get('batchable', True):
+        outputs = []
+        for i in range(batch.shape[0]):
+            interpreter.set_tensor(input_detail['index'], batch[i:i + 1])
+            interpreter.invoke()
+            outputs.append(dequantize_output(output_detail, interpreter.get_tensor(output_index)))
+        return np.concatenate(outputs, axis=0)
+
+    interpreter.set_tensor(input_detail['index'], batch)
+    interpreter.invoke()
+    return dequantize_output(output_detail, interpreter.get_tensor(output_index))
+
+class BatchScheduler:
+    """Collects single-image requests for one model type and runs them as one batch."""
+
+    def __init__(self, model_type, max_batch_size, max_wait_ms, num_workers=1):
+        self.model_type = model_type
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.pending = queue.Queue()
+        self.workers = [
+            threading.Thread(target=self._run, name=f"batch-{model_type}-{i}", daemon=True)
+            for i in range(max(1, num_workers))
+        ]
+        for worker in self.workers:
+            worker.start()
+        logger.info("Batch scheduler for %s started (max_batch_size=%d, max_wait_ms=%.1f, workers=%d)",
+                    model_type, self.max_batch_size, max_wait_ms, len(self.workers))
+
+    def submit(self, img):
+        """Queues a preprocessed (1, height, width, 3) image and returns a Future for its prediction row.
+
+        The caller must not reuse `img` until the Future resolves.
+        """
+        future = Future()
+        self.pending.put((img, future))
+        return future
+
+    def _collect(self):
+        items = [self.pending.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(items) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self.pending.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def _run(self):
+        # Each worker stacks into its own buffer so batches can run side by side
+        height, width = image_sizes[self.model_type]
+        batch_buffer = np.empty((self.max_batch_size, height, width, 3), dtype=np.float32)
+        while True:
+            items = self._collect()
+            futures = [future for _, future in items]
+            try:
+                batch = batch_buffer[:len(items)]
+                for i, (img, _) in enumerate(items):
+                    batch[i] = img[0]
+                predictions = run_inference(self.model_type, batch)
+                logger.info("Ran batch of %d for %s", batch.shape[0], self.model_type)
+                for i, future in enumerate(futures):
+                    future.set_result(predictions[i])
+            except Exception as e:
+                logger.error("Batch inference failed for %s: %s", self.model_type, str(e))
+                for future in futures:
+                    future.set_exception(e)
+
+def get_batch_scheduler(model_type):
+    with BATCH_SCHEDULERS_LOCK:
+        if model_type not in BATCH_SCHEDULERS:
+            BATCH_SCHEDULERS[model_type] = BatchScheduler(
+                model_type,
+                batch_setting('MAX_SIZE', model_type, DEFAULT_BATCH_MAX_SIZE, int),
+                batch_setting('MAX_WAIT_MS', model_type, DEFAULT_BATCH_MAX_WAIT_MS, float),
+                inference_workers(model_type)
+            )
+        return BATCH_SCHEDULERS[model_type]
+
+def predict_local(model_type, image_streams):
+    # Submit every image before waiting so they land in the same batch
+    images = get_input_buffer(model_type, len(image_streams))
+    scheduler = get_batch_scheduler(model_type)
+    futures = []
+    for i, image_stream in enumerate(image_streams):
+        preprocess_image(image_stream, model_type, out=images[i:i + 1])
+        futures.append(scheduler.submit(images[i:i + 1]))
+    return [future.result() for future in futures]
+
+def run_predictions(model_type, image_streams):
+    """Preprocesses uploaded images and returns one raw prediction row per image."""
+    if MODEL_SERVER_CLIENT is None:
+        return predict_local(model_type, image_streams)
+
+    shape = (len(image_streams), *image_sizes[model_type], 3)
+    try:
+        with MODEL_SERVER_CLIENT.input_buffer(shape) as (shm, images):
+            for i, image_stream in enumerate(image_streams):
+                preprocess_image(image_stream, model_type, out=images[i:i + 1])
+            del images  # drop the view so the block can be unlinked if the pool replaces it later
+            return list(MODEL_SERVER_CLIENT.predict(model_type, shm, shape))
+    except (OSError, EOFError) as e:
+        if not MODEL_SERVER_FALLBACK_LOCAL:
+            raise
+        logger.warning("Model server unavailable (%s); running %s inference in-process", str(e), model_type)
+        for image_stream in image_streams:
+            image_stream.seek(0)
+        return predict_local(model_type, image_streams)
+
+def model_file_hash(model_type):
+    """SHA-256 of the model file serving `model_type`, or None while it is neither verified nor in the manifest."""
+    return MODEL_STORE.sha256(model_info_for(model_type)['file'])
+
+def predict_uploads(model_type, image_streams):
+    """Returns one raw prediction row per uploaded image, serving repeated images from PREDICTION_CACHE."""
+    model_hash = model_file_hash(model_type)
+    if model_hash is None or not (PREDICTION_CACHE.max_entries or PREDICTION_CACHE.directory):
+        return run_predictions(model_type, image_streams)
+
+    uploads = [image_stream.read() for image_stream in image_streams]
+    keys = [f"{model_type}:{model_hash}:{content_hash(data)}" for data in uploads]
+    predictions = [PREDICTION_CACHE.get(key, saved_bytes=len(data)) for key, data in zip(keys, uploads)]
+    missing = [i for i, prediction in enumerate(predictions) if prediction is None]
+    if missing:
+        computed = run_predictions(model_type, [io.BytesIO(uploads[i]) for i in missing])
+        for i, prediction in zip(missing, computed):
+            predictions[i] = prediction
+            PREDICTION_CACHE.put(keys[i], np.asarray(prediction).tolist())
+    if len(missing) < len(keys):
+        logger.info("Served %d of %d %s predictions from cache", len(keys) - len(missing), len(keys), model_type)
+    return [np.asarray(prediction) for prediction in predictions]
+
+def label_for(model_type, prediction):
+    return labels[model_type][int(np.argmax(prediction))]
+
+def preload_model_types():
+    if PRELOAD_MODELS.strip().lower() == 'all':
+        return list(MODEL_FILES)
+    requested = [t.strip() for t in PRELOAD_MODELS.split(',') if t.strip()]
+    unknown = [t for t in requested if t not in MODEL_FILES]
+    if unknown:
+        logger.warning("Ignoring unknown PRELOAD_MODELS entries: %s", ", ".join(unknown))
+    return [t for t in requested if t in MODEL_FILES]
+
+def warm_up_model(model_type):
+    """Loads a model and runs one dummy inference so the first request doesn't pay for it."""
+    status = MODEL_STATUS[model_type]
+    status.update({'state': 'loading', 'error': None})
+    try:
+        start = time.monotonic()
+        load_model_for_type(model_type)
+        status['load_time_s'] = time.monotonic() - start
+
+        height, width = image_sizes[model_type]
+        start = time.monotonic()
+        run_inference(model_type, np.zeros((1, height, width, 3), dtype=np.float32))
+        status['warmup_time_s'] = time.monotonic() - start
+        status['state'] = 'ready'
+        logger.info("Model %s ready (load %.2fs, warm-up %.2fs)",
+                    model_type, status['load_time_s'], status['warmup_time_s'])
+    except Exception as e:
+        status.update({'state': 'failed', 'error': str(e)})
+        logger.error("Failed to preload %s model: %s", model_type, str(e))
+
+def models_ready(statuses):
+    """True when no model that was asked to preload is still pending, loading or failed."""
+    return all(status['state'] == 'ready' for status in statuses.values() if status['state'] != 'not_loaded')
+
+def start_preload():
+    """Loads and warms up the PRELOAD_MODELS in a background thread."""
+    model_types = preload_model_types()
+    if not model_types:
+        return None
+    for model_type in model_types:
+        MODEL_STATUS[model_type]['state'] = 'pending'
+
+    def preload():
+        # Files can be fetched in parallel, but models load one at a time to keep the
+        # footprint measurements in MODEL_CACHE meaningful
+        MODEL_STORE.ensure_all([model_info_for(model_type)['file'] for model_type in model_types])
+        for model_type in model_types:
+            warm_up_model(model_type)
+
+    thread = threading.Thread(target=preload, name="model-preload", daemon=True)
+    thread.start()
+    logger.info("Preloading models in the background: %s", ", ".join(model_types))
+    return thread
+
 def register_routes(app):
+    # The model server preloads its own models; web workers that delegate to it have none
+    if MODEL_SERVER_CLIENT is None:
+        start_preload()
+
     @app.route('/health', methods=['GET'])
     def health_check():
-        """Simple health check endpoint."""
+        """Health check endpoint with per-model readiness.
+
+        Returns 503 until every model listed in PRELOAD_MODELS is loaded and warmed up. With a
+        model server, that is checked on every server, and an unreachable server is not ready.
+        """
         log_memory_usage()
         logger.info("Health check endpoint accessed")
-        return jsonify({'status': 'OK', 'message': 'HealthSphere Disease Prediction Service is running', 'available_models': list(MODEL_FILES.keys())})
+        loaded = {model_type for model_type, _ in MODEL_CACHE.items()}
+        models = {
+            model_type: dict(status, loaded=model_type in loaded, variant=MODEL_VARIANT_SELECTION[model_type])
+            for model_type, status in MODEL_STATUS.items()
+        }
+        model_servers = None
+        if MODEL_SERVER_CLIENT is None:
+            ready = models_ready(MODEL_STATUS)
+        else:
+            model_servers = MODEL_SERVER_CLIENT.status()
+            ready = all('error' not in statuses and models_ready(statuses) for statuses in model_servers.values())
+        return jsonify({
+            'status': 'OK' if ready else 'WARMING_UP',
+            'message': 'HealthSphere Disease Prediction Service is running',
+            'available_models': list(MODEL_FILES.keys()),
+            'ready': ready,
+            'models': models,
+            'model_servers': model_servers
+        }), 200 if ready else 503
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        """Inference runtime metrics for the disease prediction service."""
+        return jsonify({
+            'model_server': configured_addresses() if MODEL_SERVER_CLIENT else None,
+            'model_cache': MODEL_CACHE.stats(),
+            'prediction_cache': PREDICTION_CACHE.stats(),
+            'interpreter_pools': {
+                model_type: model_data['pool'].stats()
+                for model_type, model_data in MODEL_CACHE.items()
+                if model_data['type'] == 'tflite'
+            }
+        })
 
     @app.route('/predict', methods=['POST'])
     def predict():
@@ -169,41 +730,12 @@ def register_routes(app):
             logger.warning("Invalid model type: %s", model_type)
             return jsonify({'error': f'Invalid model type. Available models: {list(MODEL_FILES.keys())}'}), 400
 
-        image_path = "temp.jpg"
         try:
-            image_file.save(image_path)
-            logger.info("Image saved at: %s for %s", image_path, model_type)
-        except Exception as e:
-            logger.error("Failed to save image: %s", str(e))
-            return jsonify({'error': f'Failed to save image: {str(e)}'}), 500
-
-        try:
-            # Load the model (cached if already loaded)
-            model_data = load_model_for_type(model_type)
-            logger.info("Model loaded for %s", model_type)
-
-            # Preprocess image
-            img = preprocess_image(image_path, model_type)
-
-            # Run inference based on model type
-            if model_data['type'] == 'h5':
-                model = model_data['model']
-                prediction = model.predict(img)
-            else:  # tflite
-                interpreter = model_data['interpreter']
-                input_details = model_data['input_details']
-                output_details = model_data['output_details']
-                interpreter.set_tensor(input_details[0]['index'], img)
-                interpreter.invoke()
-                prediction = interpreter.get_tensor(output_details[0]['index'])
+            # Decode straight from the upload stream and run it locally or on the model server
+            prediction = predict_uploads(model_type, [image_file.stream])[0]
 
             logger.info("Raw prediction for %s: %s", model_type, prediction)
-            predicted_index = np.argmax(prediction)
-            predicted_label = labels[model_type][predicted_index]
-
-            # Clean up
-            os.remove(image_path)
-            logger.info("Temporary image removed for %s", model_type)
+            predicted_label = label_for(model_type, prediction)
 
             # Free up memory (optional, since we cache models)
             gc.collect()
@@ -211,7 +743,32 @@ def register_routes(app):
             
             return jsonify({'prediction': predicted_label})
         except Exception as e:
-            if os.path.exists(image_path):
-                os.remove(image_path)
             logger.error("Prediction failed for %s: %s", model_type, str(e))
-            return jsonify({'error': f'Prediction failed for {model_type}: {str(e)}'}), 500
\ No newline at end of file
+            return jsonify({'error': f'Prediction failed for {model_type}: {str(e)}'}), 500
+
+    @app.route('/predict/batch', methods=['POST'])
+    def predict_batch():
+        log_memory_usage()
+        image_files = request.files.getlist('images')
+        if not image_files or 'model' not in request.form:
+            logger.warning("Invalid batch request: Missing images or model type")
+            return jsonify({'error': 'Missing images or model type'}), 400
+
+        model_type = request.form['model']
+        if model_type not in MODEL_FILES:
+            logger.warning("Invalid model type: %s", model_type)
+            return jsonify({'error': f'Invalid model type. Available models: {list(MODEL_FILES.keys())}'}), 400
+
+        try:
+            raw_predictions = predict_uploads(model_type, [image_file.stream for image_file in image_files])
+            predictions = [
+                {'filename': image_file.filename, 'prediction': label_for(model_type, prediction)}
+                for image_file, prediction in zip(image_files, raw_predictions)
+            ]
+            logger.info("Batch prediction completed for %d %s images", len(predictions), model_type)
+            return jsonify({'predictions': predictions})
+        except Exception as e:
+            logger.error("Batch prediction failed for %s: %s", model_type, str(e))
+            return jsonify({'error': f'Batch prediction failed for {model_type}: {str(e)}'}), 500
+        finally:
+            gc.collect()
@@ -1,20 +1,84 @@
 import os
-import google.generativeai as genai
 import logging
+import math
 from flask import request, jsonify
+from scripts import llmClient, planCache
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Load Gemini API key
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if not GEMINI_API_KEY:
-    logger.error("GEMINI_API_KEY environment variable not set")
-    raise ValueError("GEMINI_API_KEY environment variable not set")
+# Plans are cached per profile bucket (see planCache); an empty PLAN_CACHE_PATH
+# disables the cache and generates a plan for the exact profile on every request
+PLAN_CACHE_PATH = os.getenv("PLAN_CACHE_PATH", "plan_cache.sqlite3")
+PLAN_CACHE_MAX_ENTRIES = int(os.getenv("PLAN_CACHE_MAX_ENTRIES", "5000"))
+PLAN_CACHE_TTL_S = float(os.getenv("PLAN_CACHE_TTL_S", str(30 * 24 * 3600)))
+# Buckets whose request counts are kept for prewarming (see planCache)
+PLAN_CACHE_MAX_DEMAND_ENTRIES = int(os.getenv("PLAN_CACHE_MAX_DEMAND_ENTRIES", "50000"))
+PLAN_STORE = planCache.PlanStore(
+    PLAN_CACHE_PATH, PLAN_CACHE_MAX_ENTRIES, PLAN_CACHE_TTL_S or None, PLAN_CACHE_MAX_DEMAND_ENTRIES
+) if PLAN_CACHE_PATH else None
 
-genai.configure(api_key=GEMINI_API_KEY)
-model = genai.GenerativeModel('gemini-1.5-flash')
+def invalid_measurements(data):
+    """Which of age, height and weight are not positive numbers (numeric strings are accepted)."""
+    invalid = []
+    for field in ('age', 'height', 'weight'):
+        try:
+            value = float(data[field])
+        except (TypeError, ValueError):
+            invalid.append(field)
+            continue
+        if not math.isfinite(value) or value <= 0:
+            invalid.append(field)
+    return invalid
+
+def build_plan_prompt(plan_type, age, gender, height, weight, bmi, activity_level, fitness_level, primary_goal, dietary_preference):
+    if plan_type == 'diet':
+        prompt = f"""
+        You are a fitness and nutrition expert. Generate a personalized nutrition plan for a {age}-year-old {gender} who is {height} cm tall, weighs {weight} kg, has a BMI of {bmi}, an activity level of "{activity_level}", a fitness level of {fitness_level}/5, a primary goal of "{primary_goal}", and a dietary preference of "{dietary_preference}". 
+
+        Provide the following sections in plain text (do not use markdown or special characters like ** or * for formatting):
+        Overview: A brief summary of the user's profile and recommendations (e.g., caloric intake, focus areas).
+        Sample Meal Plan: A detailed daily meal plan with breakfast, mid-morning snack, lunch, afternoon snack, dinner, and an optional evening snack.
+        Water Intake: Recommended daily water intake.
+        Pro Tips: 3-5 actionable tips to help achieve the goal.
+
+        Format the response with clear section headers (e.g., "Overview", "Sample Meal Plan") separated by newlines.
+        """
+    else:
+        prompt = f"""
+        You are a fitness and nutrition expert. Generate a personalized workout plan for a {age}-year-old {gender} who is {height} cm tall, weighs {weight} kg, has a BMI of {bmi}, an activity level of "{activity_level}", a fitness level of {fitness_level}/5, and a primary goal of "{primary_goal}". 
+
+        Provide the following sections in plain text (do not use markdown or special characters like ** or * for formatting):
+        Overview: A brief summary of the user's fitness profile and workout recommendations.
+        Weekly Workout Plan: A detailed weekly workout plan with exercises for each day (e.g., Monday: Cardio, Tuesday: Strength Training).
+        Warm-Up and Cool-Down: Suggested warm-up and cool-down routines.
+        Pro Tips: 3-5 actionable tips to help achieve the fitness goal.
+
+        Format the response with clear section headers (e.g., "Overview", "Weekly Workout Plan") separated by newlines.
+        """
+
+    return prompt
+
+def generate_bucket_plan(bucket):
+    """Generates the plan shared by every profile in a plan cache bucket."""
+    return llmClient.generate(bucket_prompt(bucket), tag='fitness').text
+
+def bucket_prompt(bucket):
+    profile = planCache.representative_profile(bucket)
+    return build_plan_prompt(
+        bucket['planType'], profile['age'], bucket['gender'], f"about {profile['height']}", f"about {profile['weight']}",
+        f"about {profile['bmi']:.1f}", bucket['activityLevel'], bucket['fitnessLevel'], bucket['primaryGoal'],
+        bucket.get('dietaryPreference', 'none')
+    )
+
+def caching_stream(chunks, key, bucket):
+    """Passes streamed chunks through and caches the full plan once the stream completes."""
+    parts = []
+    for text in chunks:
+        parts.append(text)
+        yield text
+    PLAN_STORE.put(key, bucket, "".join(parts))
 
 def register_routes(app):
     @app.route('/generate-plan', methods=['POST'])
@@ -41,41 +105,48 @@ def register_routes(app):
                 logger.warning("Missing required fields: %s", ", ".join(missing_fields))
                 return jsonify({'error': f'Missing required fields: {", ".join(missing_fields)}'}), 400
 
-            bmi = weight / ((height / 100) ** 2)
-
-            if plan_type == 'diet':
-                prompt = f"""
-                You are a fitness and nutrition expert. Generate a personalized nutrition plan for a {age}-year-old {gender} who is {height} cm tall, weighs {weight} kg, has a BMI of {bmi:.1f}, an activity level of "{activity_level}", a fitness level of {fitness_level}/5, a primary goal of "{primary_goal}", and a dietary preference of "{dietary_preference}". 
+            invalid_fields = invalid_measurements(data)
+            if invalid_fields:
+                logger.warning("Invalid numeric fields: %s", ", ".join(invalid_fields))
+                return jsonify({'error': f'Fields must be positive numbers: {", ".join(invalid_fields)}'}), 400
 
-                Provide the following sections in plain text (do not use markdown or special characters like ** or * for formatting):
-                Overview: A brief summary of the user's profile and recommendations (e.g., caloric intake, focus areas).
-                Sample Meal Plan: A detailed daily meal plan with breakfast, mid-morning snack, lunch, afternoon snack, dinner, and an optional evening snack.
-                Water Intake: Recommended daily water intake.
-                Pro Tips: 3-5 actionable tips to help achieve the goal.
+            bmi = float(weight) / ((float(height) / 100) ** 2)
 
-                Format the response with clear section headers (e.g., "Overview", "Sample Meal Plan") separated by newlines.
-                """
+            stream = llmClient.wants_stream(data)
+            if PLAN_STORE is not None:
+                bucket = planCache.bucket_profile(data, plan_type)
+                key = planCache.bucket_key(bucket)
+                PLAN_STORE.record_demand(key, bucket)
+                plan = PLAN_STORE.get(key)
+                if plan is not None:
+                    logger.info("Serving cached %s plan for bucket %s", plan_type, key)
+                    if stream:
+                        return llmClient.event_stream(iter([plan]))
+                    return jsonify({'plan': plan})
+                prompt = bucket_prompt(bucket)
             else:
-                prompt = f"""
-                You are a fitness and nutrition expert. Generate a personalized workout plan for a {age}-year-old {gender} who is {height} cm tall, weighs {weight} kg, has a BMI of {bmi:.1f}, an activity level of "{activity_level}", a fitness level of {fitness_level}/5, and a primary goal of "{primary_goal}". 
-
-                Provide the following sections in plain text (do not use markdown or special characters like ** or * for formatting):
-                Overview: A brief summary of the user's fitness profile and workout recommendations.
-                Weekly Workout Plan: A detailed weekly workout plan with exercises for each day (e.g., Monday: Cardio, Tuesday: Strength Training).
-                Warm-Up and Cool-Down: Suggested warm-up and cool-down routines.
-                Pro Tips: 3-5 actionable tips to help achieve the fitness goal.
-
-                Format the response with clear section headers (e.g., "Overview", "Weekly Workout Plan") separated by newlines.
-                """
+                prompt = build_plan_prompt(plan_type, age, gender, height, weight, f"{bmi:.1f}", activity_level,
+                                           fitness_level, primary_goal, dietary_preference)
 
             logger.info("Generating %s plan for user: age=%s, gender=%s, height=%s cm, weight=%s kg, activity=%s, fitness=%s/5, goal=%s", 
                         plan_type, age, gender, height, weight, activity_level, fitness_level, primary_goal)
-            response = model.generate_content(prompt)
+            if stream:
+                chunks = llmClient.stream(prompt, tag='fitness')
+                if PLAN_STORE is not None:
+                    chunks = caching_stream(chunks, key, bucket)
+                return llmClient.event_stream(chunks, error_message='Failed to generate plan')
+            response = llmClient.generate(prompt, tag='fitness')
             plan = response.text
+            if PLAN_STORE is not None:
+                PLAN_STORE.put(key, bucket, plan)
 
             logger.info("Successfully generated %s plan", plan_type)
             return jsonify({'plan': plan})
 
         except Exception as e:
             logger.error("Failed to generate plan: %s", str(e))
-            return jsonify({'error': f'Failed to generate plan: {str(e)}'}), 500
\ No newline at end of file
+            return jsonify({'error': f'Failed to generate plan: {str(e)}'}), 500
+
+    @app.route('/generate-plan/metrics', methods=['GET'])
+    def generate_plan_metrics():
+        return jsonify({'plan_cache': PLAN_STORE.stats() if PLAN_STORE is not None else None})
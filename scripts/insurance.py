@@ -1,20 +1,46 @@
 import os
-import google.generativeai as genai
+import json
 import logging
-from flask import request, jsonify
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import Response, request, jsonify, stream_with_context
+from scripts import llmClient
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Load Gemini API key
-API_KEY = os.getenv("GEMINI_API_KEY")
-if not API_KEY:
-    logger.error("GEMINI_API_KEY environment variable not set")
-    raise ValueError("GEMINI_API_KEY environment variable not set")
+REQUIRED_FIELDS = ["age", "location", "health_status", "smoker", "income_level", "family_status"]
 
-genai.configure(api_key=API_KEY)
-model = genai.GenerativeModel('gemini-1.5-flash')
+# Bulk requests share one bounded pool and one rate limit on Gemini calls
+INSURANCE_BULK_WORKERS = int(os.getenv("INSURANCE_BULK_WORKERS", "8"))
+INSURANCE_BULK_MAX_PROFILES = int(os.getenv("INSURANCE_BULK_MAX_PROFILES", "1000"))
+INSURANCE_RATE_LIMIT_PER_S = float(os.getenv("INSURANCE_RATE_LIMIT_PER_S", "5"))
+
+class RateLimiter:
+    """Spaces calls evenly so that at most `rate` start per second across all threads."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.lock = threading.Lock()
+        self.next_slot = time.monotonic()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+bulk_executor = ThreadPoolExecutor(max_workers=INSURANCE_BULK_WORKERS, thread_name_prefix='insurance-bulk')
+rate_limiter = RateLimiter(INSURANCE_RATE_LIMIT_PER_S)
+
+def missing_profile_fields(user_profile):
+    return [field for field in REQUIRED_FIELDS if field not in user_profile]
 
 def get_health_insurance_recommendations(user_profile):
     """
@@ -26,8 +52,7 @@ def get_health_insurance_recommendations(user_profile):
     Returns:
         dict: Response with status and either the plans or an error message
     """
-    required_fields = ["age", "location", "health_status", "smoker", "income_level", "family_status"]
-    missing_fields = [field for field in required_fields if field not in user_profile]
+    missing_fields = missing_profile_fields(user_profile)
     if missing_fields:
         logger.warning("Missing required profile fields: %s", ", ".join(missing_fields))
         return {"status": "error", "message": f"Missing required profile fields: {', '.join(missing_fields)}"}
@@ -49,7 +74,7 @@ def get_health_insurance_recommendations(user_profile):
 
     try:
         logger.info("Generating health insurance recommendations for user: %s", user_profile)
-        response = model.generate_content(prompt)
+        response = llmClient.generate(prompt, tag='insurance')
         dynamic_plans = response.text
         logger.info("Successfully generated insurance plans")
         return {"status": "success", "plans": dynamic_plans}
@@ -57,6 +82,32 @@ def get_health_insurance_recommendations(user_profile):
         logger.error("Error calling Gemini API: %s", str(e))
         return {"status": "error", "message": f"Error calling Gemini API: {str(e)}"}
 
+def profile_key(user_profile):
+    # Only the required fields reach the prompt, so profiles that agree on them get the same plans
+    return json.dumps({field: user_profile[field] for field in REQUIRED_FIELDS}, sort_keys=True, default=str)
+
+def rate_limited_recommendations(user_profile):
+    rate_limiter.wait()
+    return get_health_insurance_recommendations(user_profile)
+
+def bulk_recommendations(profiles):
+    """Yields (indexes, result) as recommendations complete, one Gemini call per distinct profile."""
+    indexes_by_key = {}
+    for index, profile in enumerate(profiles):
+        indexes_by_key.setdefault(profile_key(profile), []).append(index)
+
+    futures = {
+        bulk_executor.submit(rate_limited_recommendations, profiles[indexes[0]]): indexes
+        for indexes in indexes_by_key.values()
+    }
+    try:
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+    finally:
+        # The client may disconnect part-way through; drop the calls that have not started
+        for future in futures:
+            future.cancel()
+
 def register_routes(app):
     @app.route('/api/health-insurance', methods=['POST'])
     def health_insurance():
@@ -72,4 +123,43 @@ def register_routes(app):
             return jsonify({"status": "error", "message": "No data provided"}), 400
         
         result = get_health_insurance_recommendations(user_profile)
-        return jsonify(result)
\ No newline at end of file
+        return jsonify(result)
+
+    @app.route('/api/health-insurance/bulk', methods=['POST'])
+    def health_insurance_bulk():
+        """
+        Bulk variant of /api/health-insurance.
+
+        Expects a JSON list of user profiles (or {"profiles": [...]}). Every profile is
+        validated before any recommendation is generated. Results are streamed as
+        NDJSON in completion order, one line per input profile: {"index": i, ...result}.
+        """
+        data = request.get_json()
+        profiles = data.get('profiles') if isinstance(data, dict) else data
+        if not isinstance(profiles, list) or not profiles:
+            logger.warning("Invalid bulk request: No profiles provided")
+            return jsonify({"status": "error", "message": "No profiles provided"}), 400
+        if len(profiles) > INSURANCE_BULK_MAX_PROFILES:
+            return jsonify({"status": "error",
+                            "message": f"Too many profiles (maximum {INSURANCE_BULK_MAX_PROFILES})"}), 400
+
+        errors = []
+        for index, profile in enumerate(profiles):
+            if not isinstance(profile, dict):
+                errors.append({"index": index, "message": "Profile must be an object"})
+                continue
+            missing_fields = missing_profile_fields(profile)
+            if missing_fields:
+                errors.append({"index": index, "message": f"Missing required profile fields: {', '.join(missing_fields)}"})
+        if errors:
+            logger.warning("Rejected bulk request with %d invalid profiles", len(errors))
+            return jsonify({"status": "error", "message": "Invalid profiles", "errors": errors}), 400
+
+        logger.info("Generating health insurance recommendations for %d profiles", len(profiles))
+
+        def lines():
+            for indexes, result in bulk_recommendations(profiles):
+                for index in indexes:
+                    yield json.dumps({"index": index, **result}) + "\n"
+
+        return Response(stream_with_context(lines()), mimetype='application/x-ndjson')
@@ -0,0 +1,289 @@
+"""
+Deterministic lab-metric extraction for medical reports.
+
+ANALYTES is the lexicon: one row per analyte with its synonyms, canonical unit,
+adult reference range, conversions from other common units and short advice
+for low or high results. All synonyms are compiled into a single
+case-insensitive pattern (longest first, so "HbA1c" wins over "Hb"). The ranges
+are held in numpy arrays indexed by analyte.
+
+extract_metrics() finds "<analyte> ... <value> <unit> (<range>)" on each line.
+Ranges printed in the report take precedence over the table. All values are
+then flagged in one vectorized comparison. The lines it did not consume are
+returned too, so callers can send the LLM only the rest of the report.
+local_analysis() builds a complete answer from the metrics alone.
+"""
+import re
+import numpy as np
+
+INF = float('inf')
+
+# Spellings of cell-count units, as factors to 10^3/uL and 10^6/uL
+COUNT_UNITS_THOUSANDS = {"x10^3/ul": 1.0, "10^3/ul": 1.0, "k/ul": 1.0, "x10^9/l": 1.0, "10^9/l": 1.0,
+                         "thou/ul": 1.0, "/ul": 0.001, "/cumm": 0.001, "cells/cumm": 0.001}
+COUNT_UNITS_MILLIONS = {"x10^6/ul": 1.0, "10^6/ul": 1.0, "m/ul": 1.0, "x10^12/l": 1.0, "10^12/l": 1.0,
+                        "mill/cumm": 1.0, "million/cumm": 1.0}
+
+# (name, synonyms, unit, low, high, {other unit: factor to canonical}, advice if low, advice if high)
+ANALYTES = [
+    ("Hemoglobin", ["hemoglobin", "haemoglobin", "hgb", "hb"], "g/dL", 12.0, 17.5, {"g/l": 0.1},
+     "Low hemoglobin can indicate anemia; iron studies and a follow-up blood count are worth discussing.",
+     "High hemoglobin can follow dehydration or smoking; a repeat test is worth discussing."),
+    ("Hematocrit", ["hematocrit", "haematocrit", "hct", "pcv"], "%", 36.0, 52.0, {},
+     "Low hematocrit often accompanies anemia; review together with hemoglobin.",
+     "High hematocrit can reflect dehydration; a repeat test is worth discussing."),
+    ("White Blood Cells", ["white blood cells", "white blood cell count", "wbc", "total leukocyte count", "tlc"],
+     "10^3/uL", 4.0, 11.0, COUNT_UNITS_THOUSANDS,
+     "A low white cell count can reduce resistance to infection; discuss follow-up with a doctor.",
+     "A high white cell count can indicate infection or inflammation; clinical correlation is advised."),
+    ("Red Blood Cells", ["red blood cells", "red blood cell count", "rbc"], "10^6/uL", 4.0, 6.0, COUNT_UNITS_MILLIONS,
+     "A low red cell count can indicate anemia.",
+     "A high red cell count should be reviewed with a doctor."),
+    ("Platelets", ["platelet count", "platelets", "plt"], "10^3/uL", 150.0, 400.0, COUNT_UNITS_THOUSANDS,
+     "A low platelet count can increase bleeding risk; a repeat count and medical review are advised.",
+     "A high platelet count should be reviewed with a doctor."),
+    ("MCV", ["mean corpuscular volume", "mcv"], "fL", 80.0, 100.0, {},
+     "Small red cells (low MCV) often point to iron deficiency.",
+     "Large red cells (high MCV) can point to vitamin B12 or folate deficiency."),
+    # Unqualified "glucose" or "blood sugar" is left to the LLM: without knowing whether the sample
+    # was fasting there is no single range to flag it against
+    ("Fasting Glucose", ["fasting blood glucose", "fasting blood sugar", "fasting glucose", "glucose, fasting",
+                         "glucose fasting", "fbs", "fbg"], "mg/dL", 70.0, 99.0, {"mmol/l": 18.016},
+     "Low blood glucose can cause dizziness or fainting; discuss with a doctor.",
+     "Raised glucose may indicate prediabetes or diabetes; an HbA1c test and dietary review are advised."),
+    ("Random Glucose", ["random blood glucose", "random blood sugar", "random glucose", "glucose, random",
+                        "glucose random", "rbs"], "mg/dL", 70.0, 140.0, {"mmol/l": 18.016},
+     "Low blood glucose can cause dizziness or fainting; discuss with a doctor.",
+     "Raised random glucose may indicate diabetes; a fasting glucose or HbA1c test is advised."),
+    ("HbA1c", ["hba1c", "hemoglobin a1c", "haemoglobin a1c", "glycated hemoglobin", "glycosylated hemoglobin", "a1c"],
+     "%", 4.0, 5.6, {},
+     "A low HbA1c is uncommon; review with a doctor.",
+     "A raised HbA1c indicates elevated average blood sugar; discuss diabetes screening and lifestyle changes."),
+    ("Total Cholesterol", ["total cholesterol", "serum cholesterol", "cholesterol"], "mg/dL", -INF, 200.0,
+     {"mmol/l": 38.67}, "",
+     "High cholesterol raises cardiovascular risk; diet, exercise and a lipid review are advised."),
+    ("LDL Cholesterol", ["ldl cholesterol", "ldl-c", "ldl"], "mg/dL", -INF, 100.0, {"mmol/l": 38.67}, "",
+     "High LDL raises cardiovascular risk; reduce saturated fat and discuss lipid-lowering options."),
+    ("HDL Cholesterol", ["hdl cholesterol", "hdl-c", "hdl"], "mg/dL", 40.0, INF, {"mmol/l": 38.67},
+     "Low HDL raises cardiovascular risk; regular exercise can help raise it.", ""),
+    ("Triglycerides", ["triglycerides", "triglyceride", "tg"], "mg/dL", -INF, 150.0, {"mmol/l": 88.57}, "",
+     "High triglycerides are linked to diet and metabolic risk; limit sugar, refined carbs and alcohol."),
+    ("Creatinine", ["serum creatinine", "creatinine"], "mg/dL", 0.6, 1.3, {"umol/l": 1 / 88.4},
+     "Low creatinine is usually not concerning and can reflect low muscle mass.",
+     "Raised creatinine can indicate reduced kidney function; a kidney function review is advised."),
+    ("Urea", ["blood urea nitrogen", "bun", "urea"], "mg/dL", 7.0, 20.0, {"mmol/l": 2.8},
+     "Low urea is usually not concerning.",
+     "Raised urea can reflect dehydration or reduced kidney function."),
+    ("Sodium", ["serum sodium", "sodium"], "mmol/L", 135.0, 145.0, {"meq/l": 1.0},
+     "Low sodium should be reviewed promptly with a doctor.",
+     "High sodium often reflects dehydration; review fluid intake with a doctor."),
+    ("Potassium", ["serum potassium", "potassium"], "mmol/L", 3.5, 5.1, {"meq/l": 1.0},
+     "Low potassium can affect heart rhythm; discuss with a doctor.",
+     "High potassium can affect heart rhythm and should be reviewed promptly."),
+    ("Calcium", ["serum calcium", "total calcium", "calcium"], "mg/dL", 8.5, 10.5, {"mmol/l": 4.008},
+     "Low calcium should be reviewed together with vitamin D and albumin.",
+     "High calcium should be reviewed with a doctor."),
+    ("ALT", ["alanine aminotransferase", "sgpt", "alt"], "U/L", 7.0, 56.0, {"iu/l": 1.0},
+     "", "Raised ALT can indicate liver inflammation; a liver function review is advised."),
+    ("AST", ["aspartate aminotransferase", "sgot", "ast"], "U/L", 10.0, 40.0, {"iu/l": 1.0},
+     "", "Raised AST can indicate liver or muscle injury; a liver function review is advised."),
+    ("Total Bilirubin", ["total bilirubin", "bilirubin total", "bilirubin"], "mg/dL", 0.1, 1.2, {"umol/l": 1 / 17.1},
+     "", "Raised bilirubin can indicate liver or bile duct problems; discuss with a doctor."),
+    ("Albumin", ["serum albumin", "albumin"], "g/dL", 3.5, 5.0, {"g/l": 0.1},
+     "Low albumin can reflect poor nutrition or liver or kidney disease.", "High albumin often reflects dehydration."),
+    ("TSH", ["thyroid stimulating hormone", "tsh"], "mIU/L", 0.4, 4.0, {"uiu/ml": 1.0, "miu/ml": 1000.0},
+     "Low TSH can indicate an overactive thyroid; thyroid hormone tests are advised.",
+     "High TSH can indicate an underactive thyroid; thyroid hormone tests are advised."),
+    ("Vitamin D", ["25-hydroxy vitamin d", "25-oh vitamin d", "vitamin d3", "vitamin d"], "ng/mL", 30.0, 100.0,
+     {"nmol/l": 0.4}, "Low vitamin D is common; sunlight exposure and supplementation can be discussed with a doctor.",
+     "Very high vitamin D can be toxic; review supplement use."),
+    ("Vitamin B12", ["vitamin b12", "cobalamin", "b12"], "pg/mL", 200.0, 900.0, {"pmol/l": 1.355},
+     "Low vitamin B12 can cause anemia and nerve symptoms; supplementation can be discussed.",
+     "High vitamin B12 is usually due to supplements."),
+    ("Ferritin", ["serum ferritin", "ferritin"], "ng/mL", 20.0, 300.0, {"ug/l": 1.0},
+     "Low ferritin indicates depleted iron stores.", "High ferritin can reflect inflammation or iron overload."),
+    ("Uric Acid", ["serum uric acid", "uric acid"], "mg/dL", 3.5, 7.2, {"umol/l": 1 / 59.48},
+     "", "Raised uric acid increases the risk of gout; hydration and dietary review are advised."),
+    ("Oxygen Saturation", ["oxygen saturation", "spo2", "sao2", "oxygen level"], "%", 95.0, 100.0, {},
+     "Low oxygen saturation needs prompt medical attention.", ""),
+    ("Systolic Blood Pressure", ["systolic blood pressure", "systolic"], "mmHg", 90.0, 120.0, {},
+     "Low blood pressure can cause dizziness; discuss with a doctor.",
+     "Raised blood pressure increases cardiovascular risk; monitoring and lifestyle changes are advised."),
+    ("Diastolic Blood Pressure", ["diastolic blood pressure", "diastolic"], "mmHg", 60.0, 80.0, {},
+     "Low blood pressure can cause dizziness; discuss with a doctor.",
+     "Raised blood pressure increases cardiovascular risk; monitoring and lifestyle changes are advised."),
+]
+
+NAMES = [row[0] for row in ANALYTES]
+UNITS = [row[2] for row in ANALYTES]
+REFERENCE_LOW = np.array([row[3] for row in ANALYTES], dtype=np.float64)
+REFERENCE_HIGH = np.array([row[4] for row in ANALYTES], dtype=np.float64)
+CONVERSIONS = [{unit.lower(): factor for unit, factor in row[5].items()} for row in ANALYTES]
+ADVICE = [(row[6], row[7]) for row in ANALYTES]
+ANALYTE_INDEX = {name: i for i, name in enumerate(NAMES)}
+
+SYNONYM_INDEX = {synonym: i for i, row in enumerate(ANALYTES) for synonym in row[1]}
+# "Blood pressure 120/80" is split into its systolic and diastolic analytes
+BLOOD_PRESSURE_SYNONYMS = ("blood pressure", "bp")
+ANALYTE_PATTERN = re.compile(
+    r'(?<![A-Za-z0-9])(' +
+    "|".join(re.escape(synonym) for synonym in sorted(list(SYNONYM_INDEX) + list(BLOOD_PRESSURE_SYNONYMS),
+                                                       key=len, reverse=True)) +
+    r')(?![A-Za-z])',
+    re.IGNORECASE
+)
+# Digit groups as printed in reports, e.g. "50,000" or "1,50,000" (lakh grouping), or a plain decimal
+NUMBER = r'\d{1,3}(?:,\d{2,3})+(?:\.\d+)?|\d+(?:\.\d+)?'
+# "12/03/2024" or "2024-03-12" is a date, not a value with a unit
+DATE = r'\d{1,4}(?P<sep>[/.-])\d{1,2}(?P=sep)\d{2,4}'
+# A unit never starts with a digit or a comma, so "50,000" is not read as 50 ",000"
+VALUE_PATTERN = re.compile(rf'(?<![\d.,/])(?!{DATE})(?P<value>{NUMBER})(?:\s*(?P<unit>[^\s\d,(\[][^\s(\[]*))?')
+BLOOD_PRESSURE_PATTERN = re.compile(r'(?<![\d.])(\d{2,3})\s*/\s*(\d{2,3})')
+RANGE_PATTERN = re.compile(rf'(?<![\d.,])({NUMBER})\s*(?:-|–|to)\s*({NUMBER})|([<>≤≥])\s*=?\s*({NUMBER})')
+
+def normalize_unit(unit):
+    return unit.lower().replace('µ', 'u').replace('μ', 'u').rstrip('.,;:') if unit else ''
+
+def parse_number(text):
+    return float(text.replace(',', ''))
+
+def parse_range(text):
+    """(low, high) from '13.5 - 17.5', '< 200' or '> 40' in `text`, or None."""
+    match = RANGE_PATTERN.search(text)
+    if match is None:
+        return None
+    if match.group(1):
+        return parse_number(match.group(1)), parse_number(match.group(2))
+    bound = parse_number(match.group(4))
+    return (-INF, bound) if match.group(3) in '<≤' else (bound, INF)
+
+def conversion_factor(index, unit):
+    """Factor converting `unit` to the analyte's canonical unit, or None if the unit is not recognized."""
+    unit = normalize_unit(unit)
+    if not unit or unit == normalize_unit(UNITS[index]):
+        return 1.0
+    return CONVERSIONS[index].get(unit)
+
+def scan_line(line):
+    """Raw (analyte index, value, unit, report range) hits in one line of text."""
+    matches = list(ANALYTE_PATTERN.finditer(line))
+    hits = []
+    for i, match in enumerate(matches):
+        # The value belongs to the text between this analyte name and the next one
+        segment = line[match.end():matches[i + 1].start() if i + 1 < len(matches) else len(line)]
+        synonym = match.group(1).lower()
+        if synonym in BLOOD_PRESSURE_SYNONYMS:
+            pressure = BLOOD_PRESSURE_PATTERN.search(segment)
+            if pressure:
+                hits.append((ANALYTE_INDEX["Systolic Blood Pressure"], float(pressure.group(1)), "mmHg", None))
+                hits.append((ANALYTE_INDEX["Diastolic Blood Pressure"], float(pressure.group(2)), "mmHg", None))
+            continue
+        value = VALUE_PATTERN.search(segment)
+        if value is None:
+            continue
+        unit = value.group('unit')
+        # A range printed straight after the value, e.g. "13.5 - 17.5", is not a unit
+        if unit and RANGE_PATTERN.match(unit):
+            unit = None
+        report_range = parse_range(segment[value.end() if unit else value.end('value'):])
+        hits.append((SYNONYM_INDEX[synonym], parse_number(value.group('value')), unit, report_range))
+    return hits
+
+def extract_metrics(text):
+    """Returns (metrics, remaining_text): flagged metrics in report order, and the lines the metrics
+    do not fully cover (no hits, a repeated analyte or a value that could not be flagged)."""
+    lines = text.split("\n")
+    hits = []
+    for number, line in enumerate(lines):
+        hits.extend((number, *hit) for hit in scan_line(line))
+    if not hits:
+        return [], text
+
+    # First mention of each analyte wins; later ones are usually repeated summaries,
+    # but their lines stay in the remaining text in case they are not
+    seen = set()
+    unique_hits = []
+    hit_lines = []
+    kept_lines = set()
+    for number, *hit in hits:
+        if hit[0] in seen:
+            kept_lines.add(number)
+        else:
+            seen.add(hit[0])
+            unique_hits.append(tuple(hit))
+            hit_lines.append(number)
+
+    indexes = np.array([hit[0] for hit in unique_hits])
+    values = np.array([hit[1] for hit in unique_hits], dtype=np.float64)
+    factors = np.array([conversion_factor(hit[0], hit[2]) or np.nan for hit in unique_hits], dtype=np.float64)
+    has_report_range = np.array([hit[3] is not None for hit in unique_hits])
+    report_low = np.array([hit[3][0] if hit[3] else np.nan for hit in unique_hits], dtype=np.float64)
+    report_high = np.array([hit[3][1] if hit[3] else np.nan for hit in unique_hits], dtype=np.float64)
+
+    # Report ranges are in the report's own unit; table ranges are in the canonical unit
+    compared = np.where(has_report_range, values, values * factors)
+    low = np.where(has_report_range, report_low, REFERENCE_LOW[indexes])
+    high = np.where(has_report_range, report_high, REFERENCE_HIGH[indexes])
+    status = np.select([np.isnan(compared), compared < low, compared > high], ['unknown', 'low', 'high'], 'normal')
+
+    kept_lines.update(number for number, flag in zip(hit_lines, status) if flag == 'unknown')
+    consumed = set(hit_lines) - kept_lines
+    remaining = [line for number, line in enumerate(lines) if number not in consumed]
+
+    metrics = []
+    for i, (index, value, unit, report_range) in enumerate(unique_hits):
+        if report_range is None and not np.isnan(compared[i]):
+            # Compared against the table, so report the value in the table's unit
+            value = round(float(compared[i]), 2)
+            unit = UNITS[index]
+        unit = unit or UNITS[index]
+        metrics.append({
+            'name': NAMES[index],
+            'value': value,
+            'unit': unit,
+            'reference_range': format_range(low[i], high[i], unit if report_range else UNITS[index]),
+            'status': str(status[i]),
+            'range_source': 'report' if report_range else 'reference'
+        })
+    return metrics, "\n".join(remaining)
+
+def format_range(low, high, unit):
+    if low == -INF:
+        return f"< {high:g} {unit}"
+    if high == INF:
+        return f"> {low:g} {unit}"
+    return f"{low:g} - {high:g} {unit}"
+
+def format_metrics(metrics):
+    """One compact line per metric, for use in a prompt."""
+    return "\n".join(
+        f"{metric['name']}: {metric['value']:g} {metric['unit']} (reference {metric['reference_range']}) {metric['status'].upper()}"
+        for metric in metrics
+    )
+
+def local_analysis(metrics):
+    """A complete Metrics/Analysis/Recommendations answer built from the extracted metrics alone."""
+    abnormal = [metric for metric in metrics if metric['status'] in ('low', 'high')]
+    if abnormal:
+        findings = " ".join(
+            f"{metric['name']} is {metric['status']} at {metric['value']:g} {metric['unit']} "
+            f"(reference {metric['reference_range']})." for metric in abnormal
+        )
+        analysis = f"{len(abnormal)} of {len(metrics)} recognized metrics are outside their reference range. {findings}"
+    else:
+        analysis = f"All {len(metrics)} recognized metrics are within their reference ranges."
+
+    recommendations = []
+    for metric in abnormal:
+        advice_low, advice_high = ADVICE[ANALYTE_INDEX[metric['name']]]
+        advice = advice_low if metric['status'] == 'low' else advice_high
+        if advice and advice not in recommendations:
+            recommendations.append(advice)
+    recommendations.append("Review these results with your healthcare provider, who can interpret them in the context of your history.")
+
+    return {
+        'Metrics': metrics,
+        'Analysis': analysis,
+        'Recommendations': recommendations,
+        'Note': "Generated from standard reference ranges without AI analysis; metrics that were not recognized are not included."
+    }
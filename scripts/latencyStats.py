@@ -0,0 +1,49 @@
+"""
+Call counts and recent latency percentiles, kept in memory per tag.
+
+Used for the LLM endpoint tags in llmClient and the report job stages in
+reportJobs. It imports nothing from either, so importing it has no side effects.
+"""
+import threading
+from collections import deque
+
+class LatencyStats:
+    """Call counts and recent latency percentiles per tag (an endpoint, a job stage)."""
+
+    def __init__(self, window=1000):
+        self.window = window
+        self.lock = threading.Lock()
+        self.tags = {}
+
+    def _tag(self, tag):
+        if tag not in self.tags:
+            self.tags[tag] = {'calls': 0, 'errors': 0, 'coalesced': 0, 'latencies': deque(maxlen=self.window)}
+        return self.tags[tag]
+
+    def record(self, tag, latency, ok=True):
+        with self.lock:
+            stats = self._tag(tag)
+            stats['calls'] += 1
+            if not ok:
+                stats['errors'] += 1
+            stats['latencies'].append(latency)
+
+    def record_coalesced(self, tag):
+        with self.lock:
+            self._tag(tag)['coalesced'] += 1
+
+    def snapshot(self):
+        with self.lock:
+            result = {}
+            for tag, stats in self.tags.items():
+                latencies = sorted(stats['latencies'])
+                percentile = lambda p: latencies[min(len(latencies) - 1, int(p * len(latencies)))] if latencies else None
+                result[tag] = {
+                    'calls': stats['calls'],
+                    'errors': stats['errors'],
+                    'coalesced': stats['coalesced'],
+                    'p50_s': percentile(0.50),
+                    'p95_s': percentile(0.95),
+                    'max_s': latencies[-1] if latencies else None
+                }
+            return result
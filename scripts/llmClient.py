@@ -0,0 +1,159 @@
+"""
+Shared Gemini client for every LLM-backed endpoint.
+
+google.generativeai is configured once per process and GenerativeModel
+instances are reused, so all endpoints share one client and its connection.
+Identical prompts that are already in flight are coalesced into a single
+upstream call, every call gets a timeout, and latency is recorded per endpoint
+tag and served from /llm/metrics.
+
+stream() and event_stream() let endpoints forward chunks to the client as
+server-sent events while Gemini is still generating.
+"""
+import os
+import hashlib
+import json
+import logging
+import threading
+import time
+from concurrent.futures import Future
+import google.generativeai as genai
+from flask import Response, jsonify, request, stream_with_context
+from scripts.latencyStats import LatencyStats
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Load Gemini API key (GOOGLE_API_KEY is what the pill identifier used)
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
+if not GEMINI_API_KEY:
+    logger.error("GEMINI_API_KEY environment variable not set")
+    raise ValueError("GEMINI_API_KEY environment variable not set")
+
+genai.configure(api_key=GEMINI_API_KEY)
+
+DEFAULT_MODEL = "gemini-1.5-flash"
+LLM_TIMEOUT_S = float(os.getenv("LLM_TIMEOUT_S", "60"))
+
+MODELS = {}
+MODELS_LOCK = threading.Lock()
+
+def get_model(model_name=DEFAULT_MODEL):
+    """Returns the shared GenerativeModel for `model_name`."""
+    with MODELS_LOCK:
+        if model_name not in MODELS:
+            MODELS[model_name] = genai.GenerativeModel(model_name)
+        return MODELS[model_name]
+
+LLM_STATS = LatencyStats()
+
+# Futures for upstream calls currently in flight, keyed by request_key()
+IN_FLIGHT = {}
+IN_FLIGHT_LOCK = threading.Lock()
+
+def request_key(model_name, contents, generation_config):
+    payload = json.dumps([model_name, contents, generation_config], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def generate(contents, tag, model_name=DEFAULT_MODEL, generation_config=None, timeout=None):
+    """Runs generate_content on the shared model and returns its response.
+
+    Callers with the same model, contents and generation config as a call that is
+    still running wait for that call's response instead of making their own.
+    """
+    timeout = timeout or LLM_TIMEOUT_S
+    key = request_key(model_name, contents, generation_config)
+    with IN_FLIGHT_LOCK:
+        future = IN_FLIGHT.get(key)
+        leader = future is None
+        if leader:
+            future = IN_FLIGHT[key] = Future()
+
+    if not leader:
+        LLM_STATS.record_coalesced(tag)
+        logger.info("Coalesced %s request with an identical call in flight", tag)
+        return future.result(timeout=timeout)
+
+    start = time.monotonic()
+    try:
+        response = get_model(model_name).generate_content(
+            contents,
+            generation_config=generation_config,
+            request_options={'timeout': timeout}
+        )
+        LLM_STATS.record(tag, time.monotonic() - start)
+        future.set_result(response)
+        return response
+    except Exception as e:
+        LLM_STATS.record(tag, time.monotonic() - start, ok=False)
+        future.set_exception(e)
+        raise
+    finally:
+        with IN_FLIGHT_LOCK:
+            IN_FLIGHT.pop(key, None)
+
+def stream(contents, tag, model_name=DEFAULT_MODEL, generation_config=None, timeout=None):
+    """Yields response text chunks as Gemini produces them.
+
+    Streams are not coalesced; time to the first chunk is recorded as `<tag>:first_chunk`.
+    """
+    timeout = timeout or LLM_TIMEOUT_S
+    start = time.monotonic()
+    first_chunk = True
+    try:
+        response = get_model(model_name).generate_content(
+            contents,
+            generation_config=generation_config,
+            stream=True,
+            request_options={'timeout': timeout}
+        )
+        for chunk in response:
+            text = chunk.text
+            if first_chunk:
+                LLM_STATS.record(f"{tag}:first_chunk", time.monotonic() - start)
+                first_chunk = False
+            if text:
+                yield text
+    except Exception:
+        LLM_STATS.record(tag, time.monotonic() - start, ok=False)
+        raise
+    LLM_STATS.record(tag, time.monotonic() - start)
+
+def wants_stream(data=None):
+    """True when the client opted into streaming via ?stream=1, {"stream": true} or Accept: text/event-stream."""
+    if request.args.get('stream', '').lower() in ('1', 'true', 'yes'):
+        return True
+    if isinstance(data, dict) and data.get('stream') is True:
+        return True
+    return 'text/event-stream' in request.headers.get('Accept', '')
+
+def sse_event(data, event=None):
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+def event_stream(chunks, suffix=None, error_message=None):
+    """Streams `chunks` as server-sent events: one `{"text": ...}` message per chunk,
+    then `suffix` (if any) and a final `done` event. A failure part-way through is
+    sent as an `error` event, since the 200 status has already gone out."""
+    def events():
+        try:
+            for text in chunks:
+                yield sse_event({'text': text})
+            if suffix:
+                yield sse_event({'text': suffix})
+            yield sse_event({}, event='done')
+        except Exception as e:
+            logger.error("Streaming response failed: %s", str(e))
+            yield sse_event({'error': error_message or str(e)}, event='error')
+
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def register_routes(app):
+    @app.route('/llm/metrics', methods=['GET'])
+    def llm_metrics():
+        return jsonify(LLM_STATS.snapshot())
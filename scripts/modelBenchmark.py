@@ -0,0 +1,188 @@
+"""
+Accuracy/latency benchmark for the disease prediction model variants.
+
+Runs every available variant (float32, float16, int8) of one model type over a
+local image folder and reports p50/p95/p99 single-image latency, peak RSS and
+top-1 agreement with the float32 model. The folder holds one sub-folder per
+label, named as in disaesePrediction.labels; unlabelled images at the top level
+only count towards agreement.
+
+    python -m scripts.modelBenchmark run --model chest --images data/chest
+    python -m scripts.modelBenchmark convert --model brain --images data/brain
+
+`convert` builds the float16 and int8 TFLite variants of a Keras (.h5) model,
+using the folder's images as the int8 calibration set.
+"""
+import os
+import argparse
+import json
+import logging
+import multiprocessing
+import resource
+import time
+import numpy as np
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+def list_images(image_dir):
+    """Returns (path, label or None) pairs for the images under `image_dir`."""
+    images = []
+    for entry in sorted(os.listdir(image_dir)):
+        path = os.path.join(image_dir, entry)
+        if os.path.isdir(path):
+            images.extend(
+                (os.path.join(path, name), entry)
+                for name in sorted(os.listdir(path)) if name.lower().endswith(IMAGE_EXTENSIONS)
+            )
+        elif entry.lower().endswith(IMAGE_EXTENSIONS):
+            images.append((path, None))
+    return images
+
+def load_images(prediction, model_type, image_paths):
+    height, width = prediction.image_sizes[model_type]
+    images = np.empty((len(image_paths), height, width, 3), dtype=np.float32)
+    for i, path in enumerate(image_paths):
+        with open(path, 'rb') as f:
+            prediction.preprocess_image(f, model_type, out=images[i:i + 1])
+    return images
+
+def benchmark_variant(model_type, variant, image_paths, warmup):
+    """Runs in a fresh process so the peak RSS belongs to this variant alone."""
+    from scripts import disaesePrediction as prediction
+
+    model_info = prediction.model_info_for(model_type, variant)
+    model_path = prediction.MODEL_STORE.path(model_info['file'])
+    images = load_images(prediction, model_type, image_paths)
+
+    start = time.perf_counter()
+    model_data = prediction.build_model(model_type, model_info, model_path, pool_size=1)
+    load_time = time.perf_counter() - start
+
+    for i in range(min(warmup, len(images))):
+        prediction.run_model(model_type, model_data, images[i:i + 1])
+
+    latencies = []
+    predicted = []
+    for i in range(len(images)):
+        start = time.perf_counter()
+        output = prediction.run_model(model_type, model_data, images[i:i + 1])
+        latencies.append((time.perf_counter() - start) * 1000)
+        predicted.append(int(np.argmax(output)))
+
+    return {
+        'file': model_info['file'],
+        'load_time_s': load_time,
+        'latencies_ms': latencies,
+        'predictions': predicted,
+        # ru_maxrss is reported in KB on Linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    }
+
+def summarize(result, reference, labels, truth):
+    latencies = np.asarray(result['latencies_ms'])
+    predictions = np.asarray(result['predictions'])
+    summary = {
+        'file': result['file'],
+        'load_time_s': round(result['load_time_s'], 3),
+        'p50_ms': round(float(np.percentile(latencies, 50)), 2),
+        'p95_ms': round(float(np.percentile(latencies, 95)), 2),
+        'p99_ms': round(float(np.percentile(latencies, 99)), 2),
+        'peak_rss_mb': round(result['peak_rss_mb'], 1),
+        'agreement': None,
+        'accuracy': None
+    }
+    if reference is not None:
+        summary['agreement'] = round(float(np.mean(predictions == np.asarray(reference['predictions']))), 4)
+    labelled = [(i, labels.index(label)) for i, label in enumerate(truth) if label in labels]
+    if labelled:
+        summary['accuracy'] = round(float(np.mean([predictions[i] == expected for i, expected in labelled])), 4)
+    return summary
+
+def run_benchmark(model_type, image_dir, variants, warmup):
+    from scripts import disaesePrediction as prediction
+
+    images = list_images(image_dir)
+    if not images:
+        raise ValueError(f"No images found in {image_dir}")
+    image_paths = [path for path, _ in images]
+    truth = [label for _, label in images]
+
+    results = {}
+    # A fresh interpreter process per variant keeps peak RSS and TF state independent
+    context = multiprocessing.get_context('spawn')
+    for variant in variants:
+        with context.Pool(1) as pool:
+            try:
+                results[variant] = pool.apply(benchmark_variant, (model_type, variant, image_paths, warmup))
+            except Exception as e:
+                logger.error("Skipping %s %s variant: %s", model_type, variant, str(e))
+
+    reference = results.get('float32')
+    return {
+        variant: summarize(result, reference, prediction.labels[model_type], truth)
+        for variant, result in results.items()
+    }
+
+def convert_keras_variants(model_type, image_dir, variants):
+    """Writes quantized TFLite variants of a Keras model into MODEL_DIR."""
+    import tensorflow as tf
+    from scripts import disaesePrediction as prediction
+
+    model_info = prediction.MODEL_FILES[model_type]
+    if model_info['type'] != 'h5':
+        raise ValueError(f"The {model_type} model is already TFLite; export its variants from the "
+                         f"original training model and place them in MODEL_SOURCE_DIR")
+
+    model = tf.keras.models.load_model(prediction.MODEL_STORE.path(model_info['file']))
+    calibration = load_images(prediction, model_type, [path for path, _ in list_images(image_dir)][:200])
+
+    for variant in variants:
+        converter = tf.lite.TFLiteConverter.from_keras_model(model)
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        if variant == 'float16':
+            converter.target_spec.supported_types = [tf.float16]
+        elif variant == 'int8':
+            if not len(calibration):
+                raise ValueError("int8 conversion needs calibration images")
+            converter.representative_dataset = lambda: ([calibration[i:i + 1]] for i in range(len(calibration)))
+            converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        else:
+            raise ValueError(f"Unknown variant: {variant}")
+        output_path = os.path.join(prediction.MODEL_DIR, prediction.MODEL_VARIANTS[model_type][variant])
+        with open(output_path, 'wb') as f:
+            f.write(converter.convert())
+        logger.info("Wrote %s variant of %s to %s", variant, model_type, output_path)
+
+def print_report(model_type, report):
+    columns = ['p50_ms', 'p95_ms', 'p99_ms', 'peak_rss_mb', 'load_time_s', 'agreement', 'accuracy']
+    print(f"\n{model_type} model variants")
+    print(f"{'variant':<10}" + "".join(f"{column:>13}" for column in columns))
+    for variant, summary in report.items():
+        print(f"{variant:<10}" + "".join(f"{str(summary[column]):>13}" for column in columns))
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Benchmark or build quantized disease prediction models.")
+    parser.add_argument('command', choices=['run', 'convert'])
+    parser.add_argument('--model', required=True, choices=['eye', 'chest', 'brain'])
+    parser.add_argument('--images', required=True, help="Image folder with one sub-folder per label")
+    parser.add_argument('--variants', default='float32,float16,int8')
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--json', help="Also write the report to this file")
+    args = parser.parse_args()
+    variants = [variant.strip() for variant in args.variants.split(',') if variant.strip()]
+
+    if args.command == 'convert':
+        convert_keras_variants(args.model, args.images, [variant for variant in variants if variant != 'float32'])
+    else:
+        report = run_benchmark(args.model, args.images, variants, args.warmup)
+        print_report(args.model, report)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(report, f, indent=2)
@@ -0,0 +1,254 @@
+"""
+Out-of-process model server for the disease prediction models.
+
+Web workers normally import TensorFlow and load every model themselves. With
+MODEL_SERVER_ADDRESS set, they instead write preprocessed images into a
+shared-memory block and send its name over a local connection to a dedicated
+model process, which owns the only copy of TensorFlow and the models.
+
+Start one server per address (comma-separate MODEL_SERVER_ADDRESS to spread
+web worker threads over several servers):
+
+    MODEL_SERVER_ADDRESS=/tmp/healthsphere-models.sock python -m scripts.modelServer
+
+MODEL_SERVER_AUTHKEY is required for host:port addresses, since the protocol
+unpickles what it receives. Unix sockets fall back to a built-in key and rely
+on file permissions.
+"""
+import os
+import atexit
+import contextlib
+import itertools
+import logging
+import threading
+from multiprocessing import resource_tracker, shared_memory
+from multiprocessing.connection import Client, Listener
+import numpy as np
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Shared-memory input blocks a web worker keeps at most; requests beyond this wait for a free block
+MODEL_SERVER_SHM_BLOCKS = int(os.getenv("MODEL_SERVER_SHM_BLOCKS", "8"))
+
+def authkey(address):
+    key = os.getenv("MODEL_SERVER_AUTHKEY")
+    if key:
+        return key.encode()
+    if isinstance(address, tuple):
+        raise ValueError(f"MODEL_SERVER_AUTHKEY must be set to use the model server over TCP ({address[0]}:{address[1]})")
+    return b"healthsphere-models"
+
+def parse_address(address):
+    """Turns 'host:port' into a TCP address; anything else is a Unix socket path."""
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit():
+        return (host or '127.0.0.1', int(port))
+    return address
+
+def configured_addresses():
+    addresses = os.getenv("MODEL_SERVER_ADDRESS", "")
+    return [parse_address(a.strip()) for a in addresses.split(',') if a.strip()]
+
+def destroy_block(shm):
+    shm.unlink()
+    try:
+        shm.close()
+    except BufferError:
+        # An array still views the block; the mapping goes away with it
+        pass
+
+class SharedMemoryPool:
+    """Shared-memory blocks reused across threads, at most `max_blocks` at a time.
+
+    A block is checked out by one request at a time. Blocks are unlinked when they
+    are replaced by a larger one and when the process exits, so short-lived request
+    threads never leave blocks behind in /dev/shm.
+    """
+
+    def __init__(self, max_blocks):
+        self.max_blocks = max(1, max_blocks)
+        self.free = []
+        self.count = 0
+        self.condition = threading.Condition()
+        atexit.register(self.close)
+
+    def checkout(self, nbytes):
+        with self.condition:
+            while not self.free and self.count >= self.max_blocks:
+                self.condition.wait()
+            fitting = [shm for shm in self.free if shm.size >= nbytes]
+            if fitting:
+                shm = min(fitting, key=lambda block: block.size)
+                self.free.remove(shm)
+                return shm
+            if self.free:
+                # Every free block is too small; replace the largest so the count stays bounded
+                destroy_block(self.free.pop(self.free.index(max(self.free, key=lambda block: block.size))))
+                self.count -= 1
+            self.count += 1
+        try:
+            return shared_memory.SharedMemory(create=True, size=nbytes)
+        except Exception:
+            with self.condition:
+                self.count -= 1
+                self.condition.notify()
+            raise
+
+    def release(self, shm):
+        with self.condition:
+            self.free.append(shm)
+            self.condition.notify()
+
+    def close(self):
+        with self.condition:
+            blocks, self.free = self.free, []
+            self.count -= len(blocks)
+        for shm in blocks:
+            destroy_block(shm)
+
+class ModelServerClient:
+    """Web-worker side of the model server protocol.
+
+    Each thread keeps its own connection. Input blocks come from a shared pool and
+    are checked out for one request, so requests never share a buffer.
+    """
+
+    def __init__(self, addresses, max_blocks=MODEL_SERVER_SHM_BLOCKS):
+        self.addresses = addresses
+        # Resolved up front so a missing TCP authkey fails at startup rather than on the first request
+        self.authkeys = {address: authkey(address) for address in addresses}
+        self.next_address = itertools.cycle(addresses)
+        self.next_address_lock = threading.Lock()
+        self.local = threading.local()
+        self.blocks = SharedMemoryPool(max_blocks)
+
+    def _connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            with self.next_address_lock:
+                address = next(self.next_address)
+            conn = self.local.conn = Client(address, authkey=self.authkeys[address])
+            logger.info("Connected to model server at %s", address)
+        return conn
+
+    def _reset_connection(self):
+        conn = getattr(self.local, 'conn', None)
+        self.local.conn = None
+        if conn is not None:
+            try:
+                conn.close()
+            except OSError:
+                pass
+
+    @contextlib.contextmanager
+    def input_buffer(self, shape):
+        """Yields (block, float32 array of `shape` backed by it); the block returns to the pool afterwards."""
+        shm = self.blocks.checkout(int(np.prod(shape)) * np.dtype(np.float32).itemsize)
+        try:
+            yield shm, np.ndarray(shape, dtype=np.float32, buffer=shm.buf)
+        finally:
+            self.blocks.release(shm)
+
+    def status(self, timeout=2.0):
+        """MODEL_STATUS reported by each server, or {'error': ...} for a server that does not answer."""
+        statuses = {}
+        for address in self.addresses:
+            label = address if isinstance(address, str) else f"{address[0]}:{address[1]}"
+            try:
+                # A separate connection, so a probe never interleaves with a request on this thread's connection
+                with Client(address, authkey=self.authkeys[address]) as conn:
+                    conn.send({'status': True})
+                    if not conn.poll(timeout):
+                        raise TimeoutError(f"no reply within {timeout:g}s")
+                    statuses[label] = conn.recv()['models']
+            except Exception as e:
+                statuses[label] = {'error': str(e)}
+        return statuses
+
+    def predict(self, model_type, shm, shape):
+        """Runs the images written to `shm` by input_buffer() and returns one prediction row each."""
+        message = {'model': model_type, 'shm': shm.name, 'shape': tuple(shape)}
+        try:
+            conn = self._connection()
+            conn.send(message)
+            reply = conn.recv()
+        except (OSError, EOFError):
+            # Drop the broken connection so the next request reconnects
+            self._reset_connection()
+            raise
+        if 'error' in reply:
+            raise RuntimeError(reply['error'])
+        return reply['predictions']
+
+def attach_shared_memory(name):
+    shm = shared_memory.SharedMemory(name=name)
+    # The web worker owns the block; stop this process's tracker from unlinking it on exit
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+def run_request(prediction, shm, message):
+    model_type = message['model']
+    if model_type not in prediction.MODEL_FILES:
+        raise ValueError(f"Invalid model type: {model_type}")
+    images = np.ndarray(message['shape'], dtype=np.float32, buffer=shm.buf)
+    # Route every row through the batch scheduler so requests from all web workers batch together
+    scheduler = prediction.get_batch_scheduler(model_type)
+    futures = [scheduler.submit(images[i:i + 1]) for i in range(images.shape[0])]
+    return np.stack([future.result() for future in futures])
+
+def handle_connection(conn, prediction):
+    shm = None
+    try:
+        while True:
+            try:
+                message = conn.recv()
+            except EOFError:
+                break
+            if 'status' in message:
+                conn.send({'models': {model_type: dict(status) for model_type, status in prediction.MODEL_STATUS.items()}})
+                continue
+            try:
+                if shm is None or shm.name != message['shm'].lstrip('/'):
+                    if shm is not None:
+                        shm.close()
+                    shm = attach_shared_memory(message['shm'])
+                conn.send({'predictions': run_request(prediction, shm, message)})
+            except Exception as e:
+                logger.error("Model server request failed: %s", str(e))
+                conn.send({'error': str(e)})
+    finally:
+        if shm is not None:
+            shm.close()
+        conn.close()
+
+def serve(address):
+    # Imported here so the client side of this module never pulls in the models
+    from scripts import disaesePrediction
+
+    key = authkey(address)
+    disaesePrediction.start_preload()
+    with Listener(address, authkey=key) as listener:
+        logger.info("Model server listening on %s", address)
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as e:
+                logger.error("Failed to accept model server connection: %s", str(e))
+                continue
+            threading.Thread(target=handle_connection, args=(conn, disaesePrediction), daemon=True).start()
+
+if __name__ == "__main__":
+    import argparse
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Serve the disease prediction models to web workers.")
+    parser.add_argument('--address', help="Unix socket path or host:port (defaults to the first MODEL_SERVER_ADDRESS)")
+    args = parser.parse_args()
+
+    address = parse_address(args.address) if args.address else (configured_addresses() or [None])[0]
+    if address is None:
+        parser.error("set MODEL_SERVER_ADDRESS or pass --address")
+    serve(address)
@@ -0,0 +1,232 @@
+"""
+Verified local store for the disease prediction model files.
+
+Each artifact is fetched once into the store directory, either from its download
+URL or, for offline use, from MODEL_SOURCE_DIR, and checked against its expected
+SHA-256 and size. Entries pinned in the manifest committed with the code
+(scripts/modelManifest.json) take precedence; files without one are recorded in
+the local manifest on their first successful verification. With require_pins
+(MODEL_REQUIRE_PINS), downloadable files without a pinned entry are refused
+instead. After that, path() is a dictionary lookup, so requests never stat
+files or touch the network.
+
+Fetch and verify everything ahead of time with:
+
+    python -m scripts.modelStore
+
+and, after replacing a model file upstream, pin its new hash with:
+
+    python -m scripts.modelStore --pin
+"""
+import os
+import hashlib
+import json
+import logging
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Check if Google Drive link is accessible
+def is_url_accessible(url):
+    try:
+        response = requests.head(url, allow_redirects=True, timeout=10)
+        return response.status_code == 200
+    except Exception as e:
+        logger.error(f"Failed to access URL {url}: {str(e)}")
+        return False
+
+def copy_resumable(source, target):
+    """Copies `source` to `target`, continuing from a partial `target` if one exists."""
+    offset = os.path.getsize(target) if os.path.exists(target) else 0
+    if offset > os.path.getsize(source):
+        offset = 0
+    with open(source, 'rb') as src, open(target, 'ab' if offset else 'wb') as dst:
+        src.seek(offset)
+        shutil.copyfileobj(src, dst, HASH_CHUNK_SIZE)
+
+class ModelStore:
+    """Fetches model files once, verifies them against a manifest and serves local paths."""
+
+    def __init__(self, directory, urls, manifest_path, source_dir=None, min_size_bytes=0,
+                 pinned_path=None, require_pins=False):
+        self.directory = directory
+        self.urls = urls
+        self.manifest_path = manifest_path
+        self.pinned_path = pinned_path
+        self.source_dir = source_dir
+        self.min_size_bytes = min_size_bytes
+        self.require_pins = require_pins
+        self.verified = {}
+        # SHA-256 computed for each file verified in this process
+        self.hashes = {}
+        self.locks = {}
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.recorded = read_manifest(manifest_path)
+        # Pinned entries win over recorded ones; empty pins in the committed manifest are ignored
+        self.pinned = {name: entry for name, entry in read_manifest(pinned_path).items() if entry.get('sha256')}
+        self.manifest = {**self.recorded, **self.pinned}
+
+    def _record(self, name, entry):
+        with self.lock:
+            self.recorded[name] = entry
+            self.manifest[name] = entry
+            write_manifest(self.manifest_path, self.recorded)
+
+    def _lock_for(self, name):
+        with self.lock:
+            return self.locks.setdefault(name, threading.Lock())
+
+    def path(self, name):
+        """Returns the verified local path of `name`, fetching it on first use."""
+        path = self.verified.get(name)
+        if path is not None:
+            return path
+
+        with self._lock_for(name):
+            if name in self.verified:
+                return self.verified[name]
+            if self.require_pins and name in self.urls and name not in self.pinned:
+                raise ValueError(f"{name} has no pinned SHA-256 in {self.pinned_path}; "
+                                 "run 'python -m scripts.modelStore --pin' to pin it")
+            path = os.path.join(self.directory, name)
+            if not (os.path.exists(path) and self._verify(name, path)):
+                if os.path.exists(path):
+                    os.remove(path)
+                self._fetch(name, path)
+                if not self._verify(name, path):
+                    os.remove(path)
+                    raise ValueError(f"Downloaded file {name} failed verification")
+            self.verified[name] = path
+            return path
+
+    def ensure_all(self, names, max_workers=4):
+        """Fetches and verifies several artifacts in parallel; returns {name: error} for failures."""
+        names = [name for name in names if name not in self.verified]
+        errors = {}
+        if not names:
+            return errors
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {name: executor.submit(self.path, name) for name in names}
+        for name, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                logger.error("Failed to prepare model %s: %s", name, str(e))
+                errors[name] = str(e)
+        return errors
+
+    def _verify(self, name, path):
+        size = os.path.getsize(path)
+        # The size floor catches HTML error pages saved by gdown; local-only files are exempt
+        if name in self.urls and size < self.min_size_bytes:
+            logger.error(f"Model file {name} is too small ({size / (1024 * 1024):.2f} MB)")
+            return False
+
+        sha256 = file_sha256(path)
+        expected = self.manifest.get(name)
+        if expected is None:
+            logger.info("Recording manifest entry for %s (sha256=%s, %d bytes)", name, sha256, size)
+            self._record(name, {'sha256': sha256, 'size': size})
+        elif expected.get('size') not in (None, size) or expected.get('sha256') != sha256:
+            logger.error("Model file %s does not match the manifest (sha256=%s, %d bytes)", name, sha256, size)
+            return False
+        else:
+            logger.info("Verified model file %s", name)
+        self.hashes[name] = sha256
+        return True
+
+    def sha256(self, name):
+        """SHA-256 of `name` as verified in this process, else as the manifest expects it, or None."""
+        return self.hashes.get(name) or self.manifest.get(name, {}).get('sha256')
+
+    def _fetch(self, name, path):
+        if self.source_dir:
+            source = os.path.join(self.source_dir, name)
+            if not os.path.exists(source):
+                raise ValueError(f"{name} not found in model source directory {self.source_dir}")
+            logger.info("Copying %s from %s...", name, self.source_dir)
+            partial_path = path + '.part'
+            copy_resumable(source, partial_path)
+            os.replace(partial_path, path)
+            return
+
+        url = self.urls.get(name)
+        if not url:
+            logger.error(f"No URL found for {name}")
+            raise ValueError(f"No URL found for {name}")
+        if not is_url_accessible(url):
+            logger.error(f"Google Drive URL for {name} is not accessible")
+            raise ValueError(f"Google Drive URL for {name} is not accessible")
+        import gdown
+
+        logger.info(f"Downloading {name} from {url}...")
+        # resume=True continues from gdown's partial file if an earlier download was cut off
+        if not gdown.download(url, path, quiet=False, fuzzy=True, resume=True):
+            raise ValueError(f"Failed to download {name}")
+        logger.info(f"Successfully downloaded {name} (Size: {os.path.getsize(path) / (1024 * 1024):.2f} MB)")
+
+    def pin(self, names):
+        """Fetches and verifies `names` and writes their SHA-256 and size to the pinned manifest."""
+        self.require_pins = False
+        failures = self.ensure_all(names)
+        for name in names:
+            if name in failures:
+                continue
+            path = self.verified[name]
+            entry = {'sha256': file_sha256(path), 'size': os.path.getsize(path)}
+            logger.info("Pinning %s (sha256=%s, %d bytes)", name, entry['sha256'], entry['size'])
+            self.pinned[name] = entry
+            self.manifest[name] = entry
+        write_manifest(self.pinned_path, {**read_manifest(self.pinned_path), **self.pinned})
+        return failures
+
+def read_manifest(path):
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.error("Ignoring unreadable model manifest %s: %s", path, str(e))
+        return {}
+
+def write_manifest(path, manifest):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+        f.write("\n")
+    os.replace(tmp_path, path)
+
+if __name__ == "__main__":
+    import argparse
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Fetch and verify the disease prediction model files.")
+    parser.add_argument('--pin', action='store_true',
+                        help="write the hashes of the downloadable model files to the pinned manifest")
+    args = parser.parse_args()
+    from scripts import disaesePrediction
+
+    store = disaesePrediction.MODEL_STORE
+    names = [disaesePrediction.model_info_for(model_type)['file'] for model_type in disaesePrediction.MODEL_FILES]
+    if args.pin:
+        failures = store.pin([name for name in disaesePrediction.MODEL_URLS])
+    else:
+        failures = store.ensure_all(names)
+    raise SystemExit(1 if failures else 0)
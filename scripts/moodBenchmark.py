@@ -0,0 +1,96 @@
+"""
+Benchmarks for the chatbot's mood detection.
+
+`matcher` compares the compiled KeywordMatcher with the original loop over
+fallback_rules (one `keyword in text` scan per rule) on messages of increasing
+length. `backends` compares the mood backends (keywords, the HF API when
+HF_API_KEY is set, the local classifier when MOOD_MODEL_DIR holds a model) on
+single messages and on batches.
+
+    python -m scripts.moodBenchmark matcher [--repeat 200]
+    python -m scripts.moodBenchmark backends [--repeat 20]
+"""
+import argparse
+import random
+import time
+import timeit
+import numpy as np
+from scripts.chatbot import (MOOD_MATCHER, MOOD_MODEL_DIR, MOOD_MODEL_THREADS, HF_API_KEY, HFMoodBackend,
+                             KeywordMoodBackend, LocalMoodBackend, fallback_rules)
+
+SAMPLE_MESSAGES = [
+    "i'm stressed about my exams", "feeling lonely tonight", "bored", "I just got the job, so happy!",
+    "my friend lied to me and I'm furious", "that movie was gross", "wow, I did not expect that at all",
+    "not sure how I feel today", "I keep overthinking everything and can't sleep", "grateful for my family"
+]
+
+FILLER_WORDS = ["today", "work", "the", "meeting", "really", "about", "just", "and", "then", "weekend",
+                "family", "because", "something", "everything", "honestly", "think", "maybe", "again"]
+
+def legacy_fallback(text):
+    """The keyword loop detect_mood used before KeywordMatcher."""
+    text = text.lower()
+    for keyword, mood in fallback_rules.items():
+        if keyword in text:
+            return mood
+    return "neutral"
+
+def compiled_fallback(text):
+    return MOOD_MATCHER.match_moods(text)
+
+def make_message(words, rng, keyword=True):
+    # Filler text, optionally ending in a keyword. Without one the loop has to scan the
+    # whole message once per rule, which is its worst case.
+    message = [rng.choice(FILLER_WORDS) for _ in range(words)]
+    if keyword:
+        message[-1] = rng.choice(list(fallback_rules))
+    return " ".join(message)
+
+def run_matcher(repeat):
+    rng = random.Random(42)
+    print(f"{'words':>8}{'keyword':>9}{'legacy_us':>12}{'compiled_us':>13}{'speedup':>9}")
+    for words in (10, 100, 1000, 5000):
+        for keyword in (True, False):
+            message = make_message(words, rng, keyword)
+            legacy = timeit.timeit(lambda: legacy_fallback(message), number=repeat) / repeat * 1e6
+            compiled = timeit.timeit(lambda: compiled_fallback(message), number=repeat) / repeat * 1e6
+            print(f"{words:>8}{'yes' if keyword else 'no':>9}{legacy:>12.1f}{compiled:>13.1f}{legacy / compiled:>9.2f}")
+
+def available_backends():
+    backends = [KeywordMoodBackend()]
+    if HF_API_KEY:
+        backends.append(HFMoodBackend())
+    try:
+        backends.append(LocalMoodBackend(MOOD_MODEL_DIR, MOOD_MODEL_THREADS))
+    except Exception as e:
+        print(f"Skipping local backend: {e}")
+    return backends
+
+def run_backends(repeat, batch_size=8):
+    rng = random.Random(42)
+    print(f"{'backend':<10}{'p50_ms':>10}{'p95_ms':>10}{'batch_ms':>10}{'msgs/s':>10}")
+    for backend in available_backends():
+        single = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            backend.classify([rng.choice(SAMPLE_MESSAGES)], time.monotonic() + 30)
+            single.append((time.perf_counter() - start) * 1000)
+        batched = []
+        for _ in range(repeat):
+            batch = [rng.choice(SAMPLE_MESSAGES) for _ in range(batch_size)]
+            start = time.perf_counter()
+            backend.classify(batch, time.monotonic() + 30)
+            batched.append((time.perf_counter() - start) * 1000)
+        batch_ms = float(np.median(batched))
+        print(f"{backend.name:<10}{np.percentile(single, 50):>10.2f}{np.percentile(single, 95):>10.2f}"
+              f"{batch_ms:>10.2f}{batch_size / batch_ms * 1000:>10.0f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark chatbot mood detection.")
+    parser.add_argument('mode', nargs='?', choices=['matcher', 'backends'], default='matcher')
+    parser.add_argument('--repeat', type=int)
+    args = parser.parse_args()
+    if args.mode == 'backends':
+        run_backends(args.repeat or 20)
+    else:
+        run_matcher(args.repeat or 200)
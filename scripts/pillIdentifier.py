@@ -1,14 +1,10 @@
 from flask import Blueprint, request, jsonify
-from google.generativeai import GenerativeModel, configure
-import os
 import base64
+from scripts import llmClient
 
 # Initialize Blueprint
 pill_identifier = Blueprint('pill_identifier', __name__)
 
-# Configure Google Generative AI
-configure(api_key=os.getenv('GOOGLE_API_KEY'))
-
 # Disclaimer text
 DISCLAIMER = "\n\nIMPORTANT: This information is for educational purposes only and should not be considered medical advice. Always consult a qualified healthcare professional before starting, stopping, or changing any medication. They can provide personalized advice based on your specific medical history and current conditions."
 
@@ -27,16 +23,13 @@ def analyze_image():
         base64_content = base64.b64encode(file_content).decode('utf-8')
         mime_type = file.mimetype
 
-        # Initialize the model
-        model = GenerativeModel('gemini-1.5-flash')
-
         # Define the prompt
         prompt = ("Analyze this pill/medication image and provide information in natural language about the medication name and generic name, "
                  "its uses and purpose, common side effects, important precautions, and typical dosage. "
                  "Format the response in paragraphs without numbered lists or bullet points.")
 
         # Generate content
-        result = model.generate_content([
+        result = llmClient.generate([
             {
                 'inlineData': {
                     'mimeType': mime_type,
@@ -44,7 +37,7 @@ def analyze_image():
                 }
             },
             prompt
-        ])
+        ], tag='pill_image')
 
         response = result.text + DISCLAIMER
         return jsonify({'result': response})
@@ -61,16 +54,20 @@ def search_pill():
         if not search_text or not search_text.strip():
             return jsonify({'error': 'No search text provided'}), 400
 
-        # Initialize the model
-        model = GenerativeModel('gemini-1.5-flash')
-
         # Define the prompt
         prompt = (f"Please provide information about {search_text} in natural language, covering its generic name, uses and purpose, "
                   "common side effects, important precautions, and typical dosage. "
                   "Format the response in paragraphs without numbered lists or bullet points.")
 
+        if llmClient.wants_stream(data):
+            return llmClient.event_stream(
+                llmClient.stream(prompt, tag='pill_search'),
+                suffix=DISCLAIMER,
+                error_message='Error searching for medication. Please try again.'
+            )
+
         # Generate content
-        result = model.generate_content(prompt)
+        result = llmClient.generate(prompt, tag='pill_search')
         response = result.text + DISCLAIMER
         return jsonify({'result': response})
 
@@ -0,0 +1,230 @@
+"""
+Persistent cache of generated fitness plans, keyed on a bucketed user profile.
+
+Profiles are reduced to a canonical bucket (5-year age band, 10 cm height band,
+2.5-wide BMI band and the categorical fields) and plans are generated for the
+bucket rather than for the exact numbers, so everyone in the same bucket shares
+one cached plan. Plans live in SQLite with a TTL and LRU eviction beyond
+PLAN_CACHE_MAX_ENTRIES. Requests per bucket are counted, so the busiest buckets
+can be generated ahead of time; the counts are kept for at most
+PLAN_CACHE_MAX_DEMAND_ENTRIES buckets, dropping the least requested first:
+
+    python -m scripts.planCache prewarm [--top 50] [--profiles profiles.json]
+
+`--profiles` takes a JSON list of /generate-plan payloads (for example an export
+of existing users) and counts them towards bucket demand.
+"""
+import os
+import argparse
+import json
+import logging
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from scripts.sqliteStore import ThreadLocalConnection
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+AGE_BAND_YEARS = 5
+HEIGHT_BAND_CM = 10
+BMI_BAND_WIDTH = 2.5
+
+def band(value, width):
+    low = math.floor(float(value) / width) * width
+    return low, low + width
+
+def format_band(low, high, digits=0):
+    # Bands are half-open; show the closed upper bound the way people read ranges (30-34, 22.5-24.9)
+    step = 10 ** -digits
+    return f"{low:.{digits}f}-{high - step:.{digits}f}"
+
+def normalize_field(value):
+    return str(value).strip().lower()
+
+def bucket_profile(profile, plan_type):
+    """Canonical bucket for a /generate-plan payload."""
+    height = float(profile['height'])
+    bmi = float(profile['weight']) / ((height / 100) ** 2)
+    bucket = {
+        'planType': normalize_field(plan_type),
+        'age': format_band(*band(profile['age'], AGE_BAND_YEARS)),
+        'height': format_band(*band(height, HEIGHT_BAND_CM)),
+        'bmi': format_band(*band(bmi, BMI_BAND_WIDTH), digits=1),
+        'gender': normalize_field(profile['gender']),
+        'activityLevel': normalize_field(profile['activityLevel']),
+        'fitnessLevel': normalize_field(profile['fitnessLevel']),
+        'primaryGoal': normalize_field(profile['primaryGoal'])
+    }
+    # Dietary preference only shapes nutrition plans
+    if bucket['planType'] == 'diet':
+        bucket['dietaryPreference'] = normalize_field(profile.get('dietaryPreference') or 'none')
+    return bucket
+
+def bucket_key(bucket):
+    return json.dumps(bucket, sort_keys=True)
+
+def representative_profile(bucket):
+    """Values the plan prompt is built from: band midpoints, with the weight implied by them."""
+    height_low = float(bucket['height'].split('-')[0])
+    bmi_low = float(bucket['bmi'].split('-')[0])
+    height = height_low + HEIGHT_BAND_CM / 2
+    bmi = bmi_low + BMI_BAND_WIDTH / 2
+    return {
+        'age': bucket['age'],
+        'height': round(height),
+        'weight': round(bmi * (height / 100) ** 2),
+        'bmi': bmi
+    }
+
+class PlanStore:
+    """SQLite table of plans per bucket key, with TTL, LRU eviction and per-bucket demand counts."""
+
+    def __init__(self, path, max_entries, ttl_seconds=None, max_demand_entries=50000):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_demand_entries = max_demand_entries
+        self.ttl = ttl_seconds
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = ThreadLocalConnection(path)
+        with self._conn() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS plans (
+                key TEXT PRIMARY KEY, bucket TEXT NOT NULL, plan TEXT NOT NULL,
+                created_at REAL NOT NULL, last_used REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS plans_last_used ON plans (last_used)")
+            conn.execute("""CREATE TABLE IF NOT EXISTS demand (
+                key TEXT PRIMARY KEY, bucket TEXT NOT NULL, requests INTEGER NOT NULL, last_seen REAL NOT NULL)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS demand_requests ON demand (requests, last_seen)")
+
+    def _fresh_after(self):
+        return time.time() - self.ttl if self.ttl else 0
+
+    def get(self, key):
+        """Returns the cached plan for `key`, or None if it is missing or expired."""
+        now = time.time()
+        with self._conn() as conn:
+            row = conn.execute("SELECT plan FROM plans WHERE key = ? AND created_at >= ?",
+                               (key, self._fresh_after())).fetchone()
+            if row is not None:
+                conn.execute("UPDATE plans SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, key))
+        with self.lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return row[0]
+
+    def put(self, key, bucket, plan):
+        now = time.time()
+        with self._conn() as conn:
+            conn.execute("INSERT OR REPLACE INTO plans (key, bucket, plan, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                         (key, json.dumps(bucket, sort_keys=True), plan, now, now))
+            evicted = conn.execute("DELETE FROM plans WHERE created_at < ?", (self._fresh_after(),)).rowcount
+            count = conn.execute("SELECT COUNT(*) FROM plans").fetchone()[0]
+            if count > self.max_entries:
+                evicted += conn.execute(
+                    "DELETE FROM plans WHERE key IN (SELECT key FROM plans ORDER BY last_used LIMIT ?)",
+                    (count - self.max_entries,)
+                ).rowcount
+        if evicted:
+            with self.lock:
+                self.evictions += evicted
+
+    def record_demand(self, key, bucket):
+        with self._conn() as conn:
+            conn.execute("""INSERT INTO demand (key, bucket, requests, last_seen) VALUES (?, ?, 1, ?)
+                            ON CONFLICT(key) DO UPDATE SET requests = requests + 1, last_seen = excluded.last_seen""",
+                         (key, json.dumps(bucket, sort_keys=True), time.time()))
+            # Free-text fields make the number of buckets unbounded, so keep only the busiest ones
+            count = conn.execute("SELECT COUNT(*) FROM demand").fetchone()[0]
+            if count > self.max_demand_entries:
+                conn.execute(
+                    "DELETE FROM demand WHERE key IN (SELECT key FROM demand ORDER BY requests, last_seen LIMIT ?)",
+                    (count - self.max_demand_entries,)
+                )
+
+    def uncached_buckets(self, limit):
+        """The most requested buckets that have no fresh plan, busiest first."""
+        rows = self._conn().execute(
+            """SELECT bucket FROM demand WHERE key NOT IN (SELECT key FROM plans WHERE created_at >= ?)
+               ORDER BY requests DESC, last_seen DESC LIMIT ?""",
+            (self._fresh_after(), limit)
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def stats(self):
+        conn = self._conn()
+        entries = conn.execute("SELECT COUNT(*) FROM plans").fetchone()[0]
+        demand_entries = conn.execute("SELECT COUNT(*) FROM demand").fetchone()[0]
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': entries,
+                'max_entries': self.max_entries,
+                'demand_entries': demand_entries,
+                'max_demand_entries': self.max_demand_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': self.hits / lookups if lookups else 0.0
+            }
+
+def prewarm(store, top, profiles_path=None, workers=4):
+    """Generates plans for the `top` most requested buckets that are not cached yet."""
+    from scripts import fitness
+
+    if profiles_path:
+        with open(profiles_path) as f:
+            profiles = json.load(f)
+        for profile in profiles:
+            try:
+                bucket = bucket_profile(profile, profile.get('planType', 'diet'))
+            except (KeyError, TypeError, ValueError, ZeroDivisionError) as e:
+                logger.warning("Skipping profile %s: %s", profile, str(e))
+                continue
+            store.record_demand(bucket_key(bucket), bucket)
+
+    buckets = store.uncached_buckets(top)
+    if not buckets:
+        logger.info("No uncached plan buckets to prewarm")
+        return 0
+
+    def fill(bucket):
+        store.put(bucket_key(bucket), bucket, fitness.generate_bucket_plan(bucket))
+
+    failures = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(fill, bucket) for bucket in buckets]
+    for bucket, future in zip(buckets, futures):
+        try:
+            future.result()
+        except Exception as e:
+            failures += 1
+            logger.error("Failed to prewarm plan for %s: %s", bucket, str(e))
+    logger.info("Prewarmed %d of %d plan buckets", len(buckets) - failures, len(buckets))
+    return failures
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Fill the fitness plan cache for the most requested profile buckets.")
+    parser.add_argument('command', choices=['prewarm'])
+    parser.add_argument('--top', type=int, default=50)
+    parser.add_argument('--profiles', help="JSON list of /generate-plan payloads to count towards demand")
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    from scripts import fitness
+
+    if fitness.PLAN_STORE is None:
+        raise SystemExit("PLAN_CACHE_PATH is empty; the plan cache is disabled")
+    raise SystemExit(1 if prewarm(fitness.PLAN_STORE, args.top, args.profiles, args.workers) else 0)
@@ -1,31 +1,45 @@
-import fitz
-import google.generativeai as gemini
-import json
 import os
-import pytesseract
-from PIL import Image
+import json
 import re
 import logging
-from flask import request, jsonify
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import Response, request, jsonify, stream_with_context
 from werkzeug.utils import secure_filename
+from scripts import labMetrics, llmClient, reportChunking, reportExtraction, reportJobs
+from scripts.resultCache import ResultCache, content_hash
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Configure Tesseract path
-tesseract_cmd = os.getenv("TESSERACT_CMD")
-if tesseract_cmd:
-    pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
-else:
-    logger.warning("TESSERACT_CMD environment variable not set; assuming Tesseract is in system PATH")
+# Reports longer than this (estimated tokens) are analyzed in chunks that run concurrently
+REPORT_CHUNK_TOKENS = int(os.getenv("REPORT_CHUNK_TOKENS", "6000"))
+REPORT_CHUNK_WORKERS = int(os.getenv("REPORT_CHUNK_WORKERS", "4"))
+chunk_executor = ThreadPoolExecutor(max_workers=REPORT_CHUNK_WORKERS, thread_name_prefix='report-chunk')
+
+# Local lab-metric pre-pass (see labMetrics): 'prompt' sends the LLM the extracted metrics plus
+# only the report lines they did not cover, 'local' answers without the LLM whenever metrics
+# were found, 'off' sends the whole report as before
+REPORT_METRICS_MODE = os.getenv("REPORT_METRICS_MODE", "prompt").lower()
 
-# Configure Gemini API
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if not GEMINI_API_KEY:
-    logger.error("GEMINI_API_KEY environment variable not set")
-    raise ValueError("GEMINI_API_KEY environment variable not set")
-gemini.configure(api_key=GEMINI_API_KEY)
+# Analyses are cached by the hash of the uploaded bytes and by the hash of the normalized
+# extracted text, in memory (REPORT_CACHE_SIZE entries) and, if REPORT_CACHE_DIR is set, on disk
+REPORT_CACHE = ResultCache(
+    int(os.getenv("REPORT_CACHE_SIZE", "256")),
+    float(os.getenv("REPORT_CACHE_TTL_S", str(7 * 24 * 3600))) or None,
+    os.getenv("REPORT_CACHE_DIR"),
+    int(os.getenv("REPORT_CACHE_MAX_DISK_ENTRIES", "5000"))
+)
+
+# Async mode (?async=1): uploads are queued in SQLite and processed by background workers
+REPORT_JOB_DB_PATH = os.getenv("REPORT_JOB_DB_PATH", "report_jobs.sqlite3")
+REPORT_JOB_WORKERS = int(os.getenv("REPORT_JOB_WORKERS", "2"))
+REPORT_JOB_MAX_QUEUED = int(os.getenv("REPORT_JOB_MAX_QUEUED", "100"))
+REPORT_JOB_TTL_S = float(os.getenv("REPORT_JOB_TTL_S", str(24 * 3600)))
+REPORT_JOB_STALE_S = float(os.getenv("REPORT_JOB_STALE_S", "600"))
+# Claims after which a job that keeps going stale (e.g. crashing its worker) is failed
+REPORT_JOB_MAX_ATTEMPTS = int(os.getenv("REPORT_JOB_MAX_ATTEMPTS", "3"))
 
 # Allowed file extensions
 ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg'}
@@ -33,36 +47,44 @@ ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg'}
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def extract_text_from_pdf(pdf_path):
+def extract_text_from_pdf(pdf_bytes, filename):
     try:
-        text = ""
-        with fitz.open(pdf_path) as doc:
-            for page in doc:
-                text += page.get_text()
-        logger.info("Successfully extracted text from PDF: %s", pdf_path)
+        # Pages are separated by form feeds so long reports can be chunked on page boundaries
+        text = reportChunking.PAGE_BREAK.join(reportExtraction.extract_pdf_pages(pdf_bytes))
+        logger.info("Successfully extracted text from PDF: %s", filename)
         return text
     except Exception as e:
-        logger.error("Error extracting text from PDF %s: %s", pdf_path, str(e))
+        logger.error("Error extracting text from PDF %s: %s", filename, str(e))
         raise Exception(f"Error extracting text from PDF: {str(e)}")
 
-def extract_text_from_image(image_path):
+def extract_text_from_image(image_bytes, filename):
     try:
-        image = Image.open(image_path)
-        text = pytesseract.image_to_string(image)
-        logger.info("Successfully extracted text from image: %s", image_path)
+        text = reportExtraction.extract_image_text(image_bytes)
+        logger.info("Successfully extracted text from image: %s", filename)
         return text
     except Exception as e:
-        logger.error("OCR Error for image %s: %s", image_path, str(e))
+        logger.error("OCR Error for image %s: %s", filename, str(e))
         raise Exception(f"OCR Error: {str(e)}")
 
-def analyze_medical_report(text):
-    prompt = f"""
+def report_prompt(text, part=None, parts=None, known_metrics=None):
+    excerpt_note = ""
+    if parts and parts > 1:
+        excerpt_note = f"""
+    This is part {part} of {parts} of a longer report. Analyze only the metrics and findings in this part.
+    """
+    if known_metrics:
+        excerpt_note += f"""
+    These metrics were already extracted from the report and compared with reference ranges. Use them in your
+    Analysis and Recommendations, but list only other metrics under Metrics:
+    {labMetrics.format_metrics(known_metrics)}
+    """
+    return f"""
     You are a highly advanced medical analysis AI. Analyze the following medical report and provide a detailed summary, including:
     - Identified medical metrics (e.g., Blood Glucose, Cholesterol, CBC, Platelets, Blood Pressure, Oxygen Level, Hemoglobin, etc.)
     - Comparison with standard ranges (for all metrics, using reliable medical sources like UMLS, SNOMED CT).
     - Any abnormal findings with recommendations for further actions.
     - If specific ranges are not provided, use general medical knowledge to determine the normal ranges.
-
+    {excerpt_note}
     Medical Report:
     {text}
 
@@ -71,35 +93,124 @@ def analyze_medical_report(text):
     - Analysis
     - Recommendations
     """
-    
+
+def parse_analysis(response_text):
+    response_text = response_text.strip()
+    json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
+    if json_match:
+        cleaned_json = json_match.group(0)
+        try:
+            return json.loads(cleaned_json)
+        except json.JSONDecodeError as e:
+            logger.error("Failed to parse cleaned JSON: %s. Raw response: %s", str(e), cleaned_json)
+            raise Exception(f"Failed to parse cleaned JSON: {str(e)}. Raw response: {cleaned_json}")
+    else:
+        logger.error("No valid JSON found in response: %s", response_text)
+        raise Exception(f"No valid JSON found in response: {response_text}")
+
+def analyze_chunk(text, part=None, parts=None, known_metrics=None):
+    response = llmClient.generate(
+        report_prompt(text, part, parts, known_metrics),
+        tag='report',
+        generation_config={
+            "max_output_tokens": 3000,
+            "temperature": 0.2
+        }
+    )
+    return parse_analysis(response.text)
+
+def analyze_medical_report(text):
+    """Analyzes the report in one call, or in concurrent chunks merged in order when it is long."""
     try:
-        model = gemini.GenerativeModel('gemini-1.5-flash')
-        response = model.generate_content(
-            prompt,
-            generation_config={
-                "max_output_tokens": 3000,
-                "temperature": 0.2
-            }
-        )
-        response_text = response.text.strip()
-        json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-        if json_match:
-            cleaned_json = json_match.group(0)
-            try:
-                analysis = json.loads(cleaned_json)
-                logger.info("Successfully analyzed medical report")
-                return analysis
-            except json.JSONDecodeError as e:
-                logger.error("Failed to parse cleaned JSON: %s. Raw response: %s", str(e), cleaned_json)
-                raise Exception(f"Failed to parse cleaned JSON: {str(e)}. Raw response: {cleaned_json}")
+        metrics = []
+        if REPORT_METRICS_MODE in ('prompt', 'local'):
+            metrics, remaining_text = labMetrics.extract_metrics(text)
+            if metrics:
+                logger.info("Extracted %d lab metrics locally", len(metrics))
+                if REPORT_METRICS_MODE == 'local':
+                    return labMetrics.local_analysis(metrics)
+                text = remaining_text
+
+        chunks = reportChunking.split_report(text, REPORT_CHUNK_TOKENS)
+        if len(chunks) == 1:
+            analysis = analyze_chunk(chunks[0], known_metrics=metrics)
         else:
-            logger.error("No valid JSON found in response: %s", response_text)
-            raise Exception(f"No valid JSON found in response: {response_text}")
+            logger.info("Analyzing report in %d chunks", len(chunks))
+            # Only the first chunk needs the locally extracted metrics
+            futures = [chunk_executor.submit(analyze_chunk, chunk, i + 1, len(chunks), metrics if i == 0 else None)
+                       for i, chunk in enumerate(chunks)]
+            analysis = reportChunking.merge_analyses([future.result() for future in futures])
+        if metrics:
+            analysis['Metrics'] = reportChunking.merge_values([metrics, analysis.get('Metrics')])
+        logger.info("Successfully analyzed medical report")
+        return analysis
     except Exception as e:
         logger.error("Error analyzing medical report: %s", str(e))
         raise
 
+def report_cache_key(kind, digest):
+    # The metrics mode changes what an analysis contains, so it is part of the key
+    return f"report:{REPORT_METRICS_MODE}:{kind}:{digest}"
+
+def normalize_report_text(text):
+    return " ".join(text.split())
+
+def process_report(file_bytes, filename, set_stage=None):
+    """Extraction and analysis for one upload; `set_stage` is told when each stage starts.
+
+    Results are served from REPORT_CACHE when the same bytes, or a file with the same
+    extracted text, were analyzed before.
+    """
+    set_stage = set_stage or (lambda stage: None)
+    file_extension = filename.rsplit('.', 1)[1].lower()
+    source_type = 'pdf' if file_extension == 'pdf' else 'image'
+    upload_key = report_cache_key(source_type, content_hash(file_bytes))
+    cached = REPORT_CACHE.get(upload_key, saved_bytes=len(file_bytes))
+    if cached is not None:
+        logger.info("Serving cached analysis for %s (identical upload)", filename)
+        return cached
+
+    set_stage('extracting')
+    if file_extension == 'pdf':
+        extracted_text = extract_text_from_pdf(file_bytes, filename)
+    else:
+        extracted_text = extract_text_from_image(file_bytes, filename)
+
+    text_key = report_cache_key('text', content_hash(normalize_report_text(extracted_text).encode()))
+    cached = REPORT_CACHE.get(text_key, saved_bytes=len(extracted_text.encode()))
+    if cached is not None:
+        logger.info("Serving cached analysis for %s (identical report text)", filename)
+        result = {**cached, 'source_type': source_type}
+        REPORT_CACHE.put(upload_key, result)
+        return result
+
+    set_stage('analyzing')
+    analysis = analyze_medical_report(extracted_text)
+    result = {
+        'analysis': analysis,
+        'source_type': source_type
+    }
+    REPORT_CACHE.put(text_key, result)
+    REPORT_CACHE.put(upload_key, result)
+    return result
+
+report_jobs = reportJobs.JobQueue(
+    REPORT_JOB_DB_PATH,
+    lambda filename, payload, set_stage: process_report(payload, filename, set_stage),
+    num_workers=REPORT_JOB_WORKERS,
+    max_queued=REPORT_JOB_MAX_QUEUED,
+    ttl_seconds=REPORT_JOB_TTL_S,
+    stale_seconds=REPORT_JOB_STALE_S,
+    max_attempts=REPORT_JOB_MAX_ATTEMPTS
+)
+
+def wants_async():
+    value = request.args.get('async') or request.form.get('async') or ''
+    return value.lower() in ('1', 'true', 'yes')
+
 def register_routes(app):
+    report_jobs.start()
+
     @app.route('/analyze-report', methods=['POST'])
     def analyze_report():
         try:
@@ -114,34 +225,68 @@ def register_routes(app):
                 
             if file and allowed_file(file.filename):
                 filename = secure_filename(file.filename)
-                temp_path = os.path.join('uploads', filename)
-                os.makedirs('uploads', exist_ok=True)
-                file.save(temp_path)
-                logger.info("Saved file to: %s", temp_path)
-                
-                try:
-                    file_extension = filename.rsplit('.', 1)[1].lower()
-                    if file_extension == 'pdf':
-                        extracted_text = extract_text_from_pdf(temp_path)
-                    else:
-                        extracted_text = extract_text_from_image(temp_path)
-                    
-                    analysis = analyze_medical_report(extracted_text)
+                # Uploads are processed in memory; nothing is written under a client-chosen name
+                file_bytes = file.read()
+                logger.info("Received %s (%d bytes)", filename, len(file_bytes))
+
+                if wants_async():
+                    try:
+                        job_id = report_jobs.submit(filename, file_bytes)
+                    except reportJobs.QueueFull as e:
+                        logger.warning("Rejected report job: %s", str(e))
+                        return jsonify({'error': 'Too many reports are waiting to be analyzed. Please try again later.'}), 503
+                    logger.info("Queued report job %s for %s", job_id, filename)
                     return jsonify({
-                        'analysis': analysis,
-                        'source_type': 'pdf' if file_extension == 'pdf' else 'image'
-                    }), 200
-                    
-                finally:
-                    # Ensure the temporary file is removed even if an error occurs
-                    if os.path.exists(temp_path):
-                        os.remove(temp_path)
-                        logger.info("Removed temporary file: %s", temp_path)
-                    
+                        'job_id': job_id,
+                        'status': 'queued',
+                        'status_url': f'/analyze-report/jobs/{job_id}',
+                        'events_url': f'/analyze-report/jobs/{job_id}/events'
+                    }), 202
+
+                return jsonify(process_report(file_bytes, filename)), 200
+
             else:
                 logger.warning("Invalid file type: %s", file.filename)
                 return jsonify({'error': 'Invalid file type. Please upload a PDF or image (PNG/JPG/JPEG)'}), 400
                 
         except Exception as e:
             logger.error("Error in analyze_report: %s", str(e))
-            return jsonify({'error': str(e)}), 500
\ No newline at end of file
+            return jsonify({'error': str(e)}), 500
+
+    @app.route('/analyze-report/jobs/<job_id>', methods=['GET'])
+    def report_job_status(job_id):
+        job = report_jobs.get(job_id)
+        if job is None:
+            return jsonify({'error': 'Job not found'}), 404
+        return jsonify(job)
+
+    @app.route('/analyze-report/jobs/<job_id>/events', methods=['GET'])
+    def report_job_events(job_id):
+        """Server-sent `progress` events whenever the job changes stage, ending with its final state."""
+        if report_jobs.get(job_id) is None:
+            return jsonify({'error': 'Job not found'}), 404
+
+        def events():
+            last_update = None
+            while True:
+                job = report_jobs.get(job_id)
+                if job is None:
+                    yield llmClient.sse_event({'error': 'Job not found'}, event='error')
+                    return
+                if job['updated_at'] != last_update:
+                    last_update = job['updated_at']
+                    final = job['status'] in ('done', 'failed')
+                    yield llmClient.sse_event(job, event=job['status'] if final else 'progress')
+                    if final:
+                        return
+                time.sleep(0.5)
+
+        return Response(
+            stream_with_context(events()),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+
+    @app.route('/analyze-report/metrics', methods=['GET'])
+    def analyze_report_metrics():
+        return jsonify({'jobs': report_jobs.stats(), 'cache': REPORT_CACHE.stats()})
@@ -0,0 +1,76 @@
+"""
+Benchmark for medical report text extraction.
+
+Builds synthetic lab-report PDFs of 1, 20 and 200 pages and times the original
+path (save the upload, reopen it from disk, `text += page.get_text()`) against
+in-memory extraction, both serial and over the process pool.
+
+    python -m scripts.reportBenchmark [--pages 1,20,200] [--repeat 5] [--workers 4]
+"""
+import os
+import argparse
+import statistics
+import tempfile
+import time
+import fitz
+from scripts import reportExtraction
+
+PANEL_LINES = [
+    "Hemoglobin 13.8 g/dL (13.5 - 17.5)", "WBC 7.2 x10^3/uL (4.5 - 11.0)", "Platelets 250 x10^3/uL (150 - 400)",
+    "Glucose, fasting 104 mg/dL (70 - 99)", "Total Cholesterol 212 mg/dL (< 200)", "HDL 48 mg/dL (> 40)",
+    "LDL 131 mg/dL (< 100)", "Triglycerides 160 mg/dL (< 150)", "Creatinine 0.9 mg/dL (0.7 - 1.3)",
+    "TSH 2.1 mIU/L (0.4 - 4.0)"
+]
+
+def make_pdf(pages):
+    doc = fitz.open()
+    for number in range(pages):
+        page = doc.new_page()
+        lines = [f"Laboratory Report - page {number + 1}", ""] + PANEL_LINES * 4
+        page.insert_text((72, 72), "\n".join(lines), fontsize=10)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+def legacy_extract(pdf_bytes):
+    """The extraction /analyze-report used before reportExtraction."""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'report.pdf')
+        with open(path, 'wb') as f:
+            f.write(pdf_bytes)
+        text = ""
+        with fitz.open(path) as doc:
+            for page in doc:
+                text += page.get_text()
+        return text
+
+def time_ms(function, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+def run(page_counts, repeat, workers):
+    # Start the pool before timing so worker start-up is not charged to the first PDF
+    reportExtraction.extract_pdf_text(make_pdf(reportExtraction.REPORT_PDF_PARALLEL_MIN_PAGES), workers)
+
+    print(f"{'pages':>6}{'legacy_ms':>12}{'memory_ms':>12}{'pool_ms':>10}{'speedup':>9}")
+    for pages in page_counts:
+        pdf_bytes = make_pdf(pages)
+        expected = legacy_extract(pdf_bytes)
+        if reportExtraction.extract_pdf_text(pdf_bytes, workers) != expected:
+            raise AssertionError(f"Extracted text differs from the legacy path for {pages} pages")
+        legacy = time_ms(lambda: legacy_extract(pdf_bytes), repeat)
+        memory = time_ms(lambda: reportExtraction.extract_pdf_text(pdf_bytes, workers=1), repeat)
+        pool = time_ms(lambda: reportExtraction.extract_pdf_text(pdf_bytes, workers), repeat)
+        print(f"{pages:>6}{legacy:>12.1f}{memory:>12.1f}{pool:>10.1f}{legacy / min(memory, pool):>9.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark report text extraction.")
+    parser.add_argument('--pages', default='1,20,200')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=reportExtraction.REPORT_PDF_WORKERS)
+    args = parser.parse_args()
+    run([int(pages) for pages in args.pages.split(',')], args.repeat, args.workers)
@@ -0,0 +1,113 @@
+"""
+Splitting long report text into prompt-sized chunks and merging the per-chunk analyses.
+
+split_report() cuts text at the coarsest boundary that fits the token budget:
+pages (form feeds), then sections (blank lines or ALL-CAPS header lines), then
+lines, and only as a last resort mid-line. It then packs neighbouring pieces
+back together up to the budget. merge_analyses() combines the per-chunk JSON
+results in chunk order. Lists are concatenated dropping only items that repeat
+an earlier one exactly (ignoring case and whitespace in strings), so a repeat
+result for the same metric with another value or date is kept. Dicts are merged
+key by key, so the same chunks always give the same merged result.
+"""
+import json
+import re
+
+PAGE_BREAK = "\f"
+# Rough token estimate for English report text; keeps chunking free of a tokenizer dependency
+CHARS_PER_TOKEN = 4
+
+SECTION_BOUNDARY = re.compile(r'(?<=\n)(?=\n|[A-Z][A-Z0-9 &/(),.-]{2,}:?[ \t]*\n)')
+ANALYSIS_KEYS = ('Metrics', 'Analysis', 'Recommendations')
+
+def split_pages(text):
+    return re.split(r'(?<=\f)', text)
+
+def split_sections(text):
+    return SECTION_BOUNDARY.split(text)
+
+def split_lines(text):
+    return text.splitlines(keepends=True)
+
+SPLITTERS = (split_pages, split_sections, split_lines)
+
+def split_to_fit(text, max_chars, level=0):
+    """Pieces of `text`, in order and concatenating back to it, each at most `max_chars` long."""
+    if len(text) <= max_chars:
+        return [text]
+    if level == len(SPLITTERS):
+        return [text[i:i + max_chars] for i in range(0, len(text), max_chars)]
+    parts = [part for part in SPLITTERS[level](text) if part]
+    if len(parts) == 1:
+        return split_to_fit(text, max_chars, level + 1)
+    pieces = []
+    for part in parts:
+        pieces.extend(split_to_fit(part, max_chars, level + 1))
+    return pieces
+
+def split_report(text, max_tokens):
+    """Chunks of at most `max_tokens` (estimated) that split on page and section boundaries where possible."""
+    max_chars = max(1, max_tokens * CHARS_PER_TOKEN)
+    chunks = []
+    current = []
+    size = 0
+    for piece in split_to_fit(text, max_chars):
+        if current and size + len(piece) > max_chars:
+            chunks.append("".join(current))
+            current = []
+            size = 0
+        current.append(piece)
+        size += len(piece)
+    if current:
+        chunks.append("".join(current))
+    return [chunk for chunk in chunks if chunk.strip()] or [text]
+
+def normalize_item(item):
+    if isinstance(item, str):
+        return " ".join(item.split()).lower()
+    if isinstance(item, dict):
+        return {str(key).strip().lower(): normalize_item(value) for key, value in item.items()}
+    if isinstance(item, list):
+        return [normalize_item(value) for value in item]
+    return item
+
+def item_key(item):
+    """Identity used to drop repeats when lists are merged: the whole item, ignoring case and whitespace."""
+    return json.dumps(normalize_item(item), sort_keys=True, default=str)
+
+def merge_values(values):
+    values = [value for value in values if value not in (None, "", [], {})]
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+    if all(isinstance(value, dict) for value in values):
+        merged = {}
+        for value in values:
+            for key, item in value.items():
+                merged[key] = merge_values([merged[key], item]) if key in merged else item
+        return merged
+
+    items = []
+    seen = set()
+    for value in values:
+        for item in (value if isinstance(value, list) else [value]):
+            key = item_key(item)
+            if key not in seen:
+                seen.add(key)
+                items.append(item)
+    if all(isinstance(value, str) for value in values):
+        return "\n\n".join(items)
+    return items
+
+def merge_analyses(analyses):
+    """Combines per-chunk analyses (in chunk order) into one result with the usual top-level keys first."""
+    keys = list(ANALYSIS_KEYS)
+    for analysis in analyses:
+        keys.extend(key for key in analysis if key not in keys)
+    merged = {}
+    for key in keys:
+        value = merge_values([analysis.get(key) for analysis in analyses])
+        if value is not None or key in ANALYSIS_KEYS:
+            merged[key] = value
+    return merged
@@ -0,0 +1,179 @@
+"""
+Text extraction for uploaded medical reports.
+
+Uploads are processed straight from their bytes, so nothing is written to disk.
+PDFs with at least REPORT_PDF_PARALLEL_MIN_PAGES pages are split into page
+ranges that are extracted in a process pool, since PyMuPDF holds the GIL while
+it parses. Per-page text is returned as a list and joined once.
+
+OCR is selective. Only PDF pages that have images but no usable text layer are
+rasterized, at REPORT_OCR_DPI. Every OCR input is downscaled to at most
+REPORT_OCR_MAX_SIDE pixels and binarized (Otsu threshold) before it reaches
+tesseract. Scanned pages are OCR'd in the process pool in one batch per worker,
+so each worker gets the PDF once; tall image uploads are cut into bands at
+blank rows and the bands are OCR'd in the pool.
+
+This module is imported by the pool's worker processes, so it keeps its imports
+light (no Flask, no Gemini client).
+"""
+import os
+import io
+import logging
+import math
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import fitz
+import numpy as np
+import pytesseract
+from PIL import Image
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Configure Tesseract path (here rather than in report.py so pool workers pick it up too)
+tesseract_cmd = os.getenv("TESSERACT_CMD")
+if tesseract_cmd:
+    pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+else:
+    logger.warning("TESSERACT_CMD environment variable not set; assuming Tesseract is in system PATH")
+
+REPORT_PDF_WORKERS = int(os.getenv("REPORT_PDF_WORKERS", str(min(4, os.cpu_count() or 1))))
+REPORT_PDF_PARALLEL_MIN_PAGES = int(os.getenv("REPORT_PDF_PARALLEL_MIN_PAGES", "16"))
+REPORT_PDF_OCR = os.getenv("REPORT_PDF_OCR", "1").lower() in ("1", "true", "yes")
+# Pages with fewer non-whitespace characters than this count as having no text layer
+REPORT_OCR_MIN_CHARS = int(os.getenv("REPORT_OCR_MIN_CHARS", "20"))
+REPORT_OCR_DPI = int(os.getenv("REPORT_OCR_DPI", "300"))
+# 3500 px keeps an A4 page at ~300 DPI while shrinking oversized phone photos
+REPORT_OCR_MAX_SIDE = int(os.getenv("REPORT_OCR_MAX_SIDE", "3500"))
+REPORT_OCR_BAND_HEIGHT = int(os.getenv("REPORT_OCR_BAND_HEIGHT", "1200"))
+
+EXECUTOR = None
+EXECUTOR_LOCK = threading.Lock()
+
+def get_executor():
+    """Process pool shared by all requests, started on first use."""
+    global EXECUTOR
+    with EXECUTOR_LOCK:
+        if EXECUTOR is None:
+            # spawn rather than fork: the server process has many threads running. Spawned workers
+            # re-run the server's main file as __mp_main__, so app.py only builds the app outside it
+            EXECUTOR = ProcessPoolExecutor(max_workers=REPORT_PDF_WORKERS,
+                                           mp_context=multiprocessing.get_context('spawn'))
+        return EXECUTOR
+
+def open_pdf(pdf_bytes):
+    return fitz.open(stream=pdf_bytes, filetype='pdf')
+
+def page_needs_ocr(page, text):
+    return len("".join(text.split())) < REPORT_OCR_MIN_CHARS and bool(page.get_images())
+
+def extract_page_range(pdf_bytes, start, stop):
+    """Returns (text, needs_ocr) for pages start..stop-1."""
+    with open_pdf(pdf_bytes) as doc:
+        pages = []
+        for i in range(start, stop):
+            page = doc[i]
+            text = page.get_text()
+            pages.append((text, page_needs_ocr(page, text)))
+        return pages
+
+def page_ranges(page_count, parts):
+    size = math.ceil(page_count / parts)
+    return [(start, min(start + size, page_count)) for start in range(0, page_count, size)]
+
+def otsu_threshold(gray):
+    """Grey level that best separates ink from background in a uint8 image."""
+    hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    levels = np.arange(256)
+    below = np.cumsum(hist)
+    above = gray.size - below
+    below_sum = np.cumsum(hist * levels)
+    mean_below = below_sum / np.maximum(below, 1)
+    mean_above = (below_sum[-1] - below_sum) / np.maximum(above, 1)
+    return int(np.argmax(below * above * (mean_below - mean_above) ** 2))
+
+def prepare_for_ocr(image):
+    """Greyscale, downscaled and binarized copy of `image` as a uint8 array (ink 0, paper 255)."""
+    image = image.convert('L')
+    if max(image.size) > REPORT_OCR_MAX_SIDE:
+        image.thumbnail((REPORT_OCR_MAX_SIDE, REPORT_OCR_MAX_SIDE), Image.LANCZOS)
+    gray = np.asarray(image)
+    return np.where(gray > otsu_threshold(gray), 255, 0).astype(np.uint8)
+
+def ocr_array(binary):
+    return pytesseract.image_to_string(Image.fromarray(binary))
+
+def ocr_pdf_pages(pdf_bytes, numbers):
+    """OCR text of the given pages, in order, from one open of the PDF."""
+    texts = []
+    with open_pdf(pdf_bytes) as doc:
+        for number in numbers:
+            pixmap = doc[number].get_pixmap(dpi=REPORT_OCR_DPI, colorspace=fitz.csGRAY)
+            image = Image.frombytes('L', (pixmap.width, pixmap.height), pixmap.samples)
+            texts.append(ocr_array(prepare_for_ocr(image)))
+    return texts
+
+def split_bands(binary, band_height):
+    """Cuts a tall page into bands of about `band_height` rows, at blank rows where possible
+    so no line of text is split between two bands."""
+    height = binary.shape[0]
+    if height < 2 * band_height:
+        return [binary]
+    blank_rows = np.flatnonzero((binary == 255).all(axis=1))
+    cuts = [0]
+    for target in range(band_height, height - band_height // 2, band_height):
+        nearby = blank_rows[np.abs(blank_rows - target) <= band_height // 4]
+        cut = int(nearby[np.argmin(np.abs(nearby - target))]) if len(nearby) else target
+        if cut > cuts[-1]:
+            cuts.append(cut)
+    cuts.append(height)
+    return [binary[start:stop] for start, stop in zip(cuts, cuts[1:])]
+
+def run_tasks(function, args_list, workers):
+    """Runs function(*args) for each entry, in the process pool unless workers <= 1; results keep order."""
+    if workers <= 1 or len(args_list) <= 1:
+        return [function(*args) for args in args_list]
+    executor = get_executor()
+    futures = [executor.submit(function, *args) for args in args_list]
+    return [future.result() for future in futures]
+
+def extract_pdf_pages(pdf_bytes, workers=None, ocr=None):
+    """Returns the text of every page in page order, OCR'ing pages that have no text layer."""
+    workers = workers or REPORT_PDF_WORKERS
+    ocr = REPORT_PDF_OCR if ocr is None else ocr
+    with open_pdf(pdf_bytes) as doc:
+        page_count = doc.page_count
+        parallel = workers > 1 and page_count >= REPORT_PDF_PARALLEL_MIN_PAGES
+        if not parallel:
+            pages = []
+            for page in doc:
+                text = page.get_text()
+                pages.append((text, page_needs_ocr(page, text)))
+
+    if parallel:
+        pages = []
+        ranges = [(pdf_bytes, start, stop) for start, stop in page_ranges(page_count, workers)]
+        for page_range in run_tasks(extract_page_range, ranges, workers):
+            pages.extend(page_range)
+
+    texts = [text for text, _ in pages]
+    scanned = [i for i, (_, needs_ocr) in enumerate(pages) if needs_ocr] if ocr else []
+    if scanned:
+        logger.info("Running OCR on %d of %d PDF pages without a text layer", len(scanned), page_count)
+        batches = [(pdf_bytes, scanned[start:stop]) for start, stop in page_ranges(len(scanned), workers)]
+        ocr_texts = [text for batch in run_tasks(ocr_pdf_pages, batches, workers) for text in batch]
+        for i, text in zip(scanned, ocr_texts):
+            texts[i] = text
+    return texts
+
+def extract_pdf_text(pdf_bytes, workers=None, ocr=None):
+    return "".join(extract_pdf_pages(pdf_bytes, workers, ocr))
+
+def extract_image_text(image_bytes, workers=None):
+    """OCR for an image upload; tall images are cut into bands that are OCR'd in parallel."""
+    workers = workers or REPORT_PDF_WORKERS
+    binary = prepare_for_ocr(Image.open(io.BytesIO(image_bytes)))
+    bands = split_bands(binary, REPORT_OCR_BAND_HEIGHT) if workers > 1 else [binary]
+    return "\n".join(run_tasks(ocr_array, [(band,) for band in bands], workers))
@@ -0,0 +1,217 @@
+"""
+Durable background jobs for /analyze-report.
+
+Jobs, including their uploaded bytes, are stored in SQLite, so a restart loses
+nothing. Queued jobs are picked up again. While a job runs, a heartbeat thread
+refreshes its updated_at every third of REPORT_JOB_STALE_S, so a job left
+'running' is re-queued only once its process has stopped updating it for that
+long, not because one stage is slow. Each claim counts as an attempt; a job that
+goes stale after max_attempts claims (e.g. it keeps crashing its worker process)
+is marked failed instead of being re-queued again.
+Workers claim jobs with an atomic UPDATE, so several server processes can share
+one database. Finished jobs are kept for their TTL so clients can fetch results.
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from scripts.latencyStats import LatencyStats
+from scripts.sqliteStore import ThreadLocalConnection
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class QueueFull(Exception):
+    pass
+
+class JobQueue:
+    """SQLite-backed job table drained by a fixed pool of worker threads.
+
+    `handler(filename, payload, set_stage)` does the work and returns a
+    JSON-serializable result; it calls set_stage(name) as it moves through stages.
+    """
+
+    def __init__(self, path, handler, num_workers=2, max_queued=100, ttl_seconds=24 * 3600, stale_seconds=600,
+                 max_attempts=3):
+        self.path = path
+        self.handler = handler
+        self.num_workers = max(1, num_workers)
+        self.max_queued = max_queued
+        self.ttl = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.max_attempts = max(1, max_attempts)
+        self.heartbeat_seconds = max(1.0, stale_seconds / 3)
+        self.running = set()
+        self.running_lock = threading.Lock()
+        self._conn = ThreadLocalConnection(path)
+        self.wakeup = threading.Event()
+        self.started = False
+        self.start_lock = threading.Lock()
+        self.stage_stats = LatencyStats()
+        with self._conn() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY, status TEXT NOT NULL, stage TEXT, stages TEXT NOT NULL DEFAULT '{}',
+                filename TEXT, payload BLOB, result TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL, updated_at REAL NOT NULL)""")
+            # Databases created before attempts were counted
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(jobs)")]
+            if 'attempts' not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at)")
+
+    def submit(self, filename, payload):
+        """Stores a new job and returns its ID; raises QueueFull when too many jobs are waiting."""
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        with self._conn() as conn:
+            conn.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?", (now - self.ttl,))
+            queued = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+            if queued >= self.max_queued:
+                raise QueueFull(f"{queued} report jobs are already queued")
+            conn.execute("""INSERT INTO jobs (id, status, stage, filename, payload, created_at, updated_at)
+                            VALUES (?, 'queued', 'queued', ?, ?, ?, ?)""",
+                         (job_id, filename, payload, now, now))
+        self.wakeup.set()
+        return job_id
+
+    def get(self, job_id):
+        row = self._conn().execute(
+            "SELECT id, status, stage, stages, filename, result, error, attempts, created_at, updated_at FROM jobs WHERE id = ?",
+            (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            'job_id': row[0],
+            'status': row[1],
+            'stage': row[2],
+            'stages': json.loads(row[3]),
+            'filename': row[4],
+            'result': json.loads(row[5]) if row[5] is not None else None,
+            'error': row[6],
+            'attempts': row[7],
+            'created_at': row[8],
+            'updated_at': row[9]
+        }
+
+    def _claim(self):
+        """Marks the oldest queued (or stale running) job as running and returns (id, filename, payload)."""
+        now = time.time()
+        stale_before = now - self.stale_seconds
+        with self._conn() as conn:
+            failed = conn.execute(
+                """UPDATE jobs SET status = 'failed', error = ?, payload = NULL, updated_at = ?
+                   WHERE status = 'running' AND updated_at < ? AND attempts >= ?""",
+                (f"Job was abandoned by its worker {self.max_attempts} times", now, stale_before, self.max_attempts)
+            ).rowcount
+            if failed:
+                logger.error("Failed %d report jobs that were abandoned %d times", failed, self.max_attempts)
+            conn.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running' AND updated_at < ?",
+                         (stale_before,))
+            row = conn.execute(
+                "SELECT id, filename, payload FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            claimed = conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, updated_at = ? WHERE id = ? AND status = 'queued'",
+                (now, row[0])
+            ).rowcount
+        # Another worker (possibly in another process) may have claimed it first
+        return row if claimed else None
+
+    def _update(self, job_id, **fields):
+        fields['updated_at'] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._conn() as conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def _process(self, job_id, filename, payload):
+        stages = {}
+        current = {'stage': None, 'started': time.monotonic()}
+
+        def finish_stage():
+            if current['stage'] is not None:
+                elapsed = time.monotonic() - current['started']
+                stages[current['stage']] = round(elapsed, 3)
+                self.stage_stats.record(current['stage'], elapsed)
+
+        def set_stage(stage):
+            finish_stage()
+            current['stage'] = stage
+            current['started'] = time.monotonic()
+            self._update(job_id, stage=stage, stages=json.dumps(stages))
+
+        start = time.monotonic()
+        with self.running_lock:
+            self.running.add(job_id)
+        try:
+            result = self.handler(filename, payload, set_stage)
+            finish_stage()
+            self.stage_stats.record('total', time.monotonic() - start)
+            self._update(job_id, status='done', stage='done', stages=json.dumps(stages),
+                         result=json.dumps(result), payload=None)
+            logger.info("Report job %s finished in %.2fs", job_id, time.monotonic() - start)
+        except Exception as e:
+            finish_stage()
+            self.stage_stats.record('total', time.monotonic() - start, ok=False)
+            self._update(job_id, status='failed', stages=json.dumps(stages), error=str(e), payload=None)
+            logger.error("Report job %s failed: %s", job_id, str(e))
+        finally:
+            with self.running_lock:
+                self.running.discard(job_id)
+
+    def _heartbeat(self):
+        """Keeps updated_at fresh for the jobs this process is running."""
+        while True:
+            time.sleep(self.heartbeat_seconds)
+            with self.running_lock:
+                job_ids = list(self.running)
+            if not job_ids:
+                continue
+            now = time.time()
+            try:
+                with self._conn() as conn:
+                    conn.executemany("UPDATE jobs SET updated_at = ? WHERE id = ? AND status = 'running'",
+                                     [(now, job_id) for job_id in job_ids])
+            except sqlite3.Error as e:
+                logger.error("Failed to refresh report job heartbeat: %s", str(e))
+
+    def _run(self):
+        while True:
+            try:
+                job = self._claim()
+            except sqlite3.Error as e:
+                logger.error("Failed to claim report job: %s", str(e))
+                job = None
+            if job is None:
+                # Wake up on submit, or poll now and then for jobs queued by other processes
+                self.wakeup.wait(timeout=1.0)
+                self.wakeup.clear()
+                continue
+            self._process(*job)
+
+    def start(self):
+        with self.start_lock:
+            if self.started:
+                return
+            self.started = True
+        for i in range(self.num_workers):
+            threading.Thread(target=self._run, name=f"report-job-{i}", daemon=True).start()
+        threading.Thread(target=self._heartbeat, name="report-job-heartbeat", daemon=True).start()
+        logger.info("Started %d report job workers", self.num_workers)
+
+    def stats(self):
+        counts = dict(self._conn().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return {
+            'queue_depth': counts.get('queued', 0),
+            'running': counts.get('running', 0),
+            'done': counts.get('done', 0),
+            'failed': counts.get('failed', 0),
+            'workers': self.num_workers,
+            'max_queued': self.max_queued,
+            'stage_latency': self.stage_stats.snapshot()
+        }
@@ -0,0 +1,166 @@
+"""
+Small result caches shared by the prediction and analysis endpoints.
+"""
+import os
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def content_hash(data):
+    """Hex digest used to key cached results on the bytes of an upload."""
+    return hashlib.sha256(data).hexdigest()
+
+class ResultCache:
+    """Bounded in-memory LRU in front of an optional on-disk tier, both with a TTL.
+
+    Values must be JSON-serializable. `ttl_seconds=None` keeps entries until evicted;
+    `directory=None` disables the disk tier, and `max_disk_entries` bounds it (oldest
+    files are pruned first). Callers can pass `saved_bytes` to get() to count how much
+    input each hit saved from being processed again.
+    """
+
+    def __init__(self, max_entries, ttl_seconds=None, directory=None, max_disk_entries=None):
+        self.max_entries = max(0, max_entries)
+        self.ttl = ttl_seconds
+        self.directory = directory
+        self.max_disk_entries = max_disk_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+        self.bytes_saved = 0
+        self.disk_entries = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self.disk_entries = sum(1 for name in os.listdir(directory) if name.endswith('.json'))
+
+    def _disk_path(self, key):
+        return os.path.join(self.directory, hashlib.sha256(key.encode()).hexdigest() + '.json')
+
+    def _remember(self, key, value):
+        if not self.max_entries:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        self.entries[key] = (expires_at, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def _read_disk(self, key):
+        path = self._disk_path(key)
+        try:
+            if self.ttl and time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            with open(path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning("Dropping unreadable cache entry %s: %s", path, str(e))
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+    def get(self, key, saved_bytes=0):
+        """Returns the cached value for `key`, or None on a miss."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self.entries.move_to_end(key)
+                    self.memory_hits += 1
+                    self.bytes_saved += saved_bytes
+                    return value
+                del self.entries[key]
+
+        value = self._read_disk(key) if self.directory else None
+        with self.lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self.bytes_saved += saved_bytes
+            self._remember(key, value)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self._remember(key, value)
+        if self.directory:
+            path = self._disk_path(key)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            try:
+                is_new = not os.path.exists(path)
+                with open(tmp_path, 'w') as f:
+                    json.dump(value, f)
+                os.replace(tmp_path, path)
+            except (OSError, TypeError, ValueError) as e:
+                logger.warning("Failed to write cache entry %s: %s", path, str(e))
+                return
+            with self.lock:
+                self.disk_entries += is_new
+                over_limit = self.max_disk_entries is not None and self.disk_entries > self.max_disk_entries
+            if over_limit:
+                self.prune_disk()
+
+    def prune_disk(self):
+        """Removes expired disk entries, then the oldest ones until the tier is 10% under its limit."""
+        files = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                files.append((os.path.getmtime(path), path))
+            except OSError:
+                continue
+        files.sort()
+        now = time.time()
+        keep = len(files)
+        if self.max_disk_entries is not None:
+            keep = min(keep, int(self.max_disk_entries * 0.9))
+        removed = 0
+        for i, (mtime, path) in enumerate(files):
+            if i >= len(files) - keep and not (self.ttl and now - mtime > self.ttl):
+                continue
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+        with self.lock:
+            self.disk_entries = len(files) - removed
+            self.disk_evictions += removed
+        if removed:
+            logger.info("Pruned %d entries from cache directory %s", removed, self.directory)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'disk_entries': self.disk_entries,
+                'disk_evictions': self.disk_evictions,
+                'bytes_saved': self.bytes_saved,
+                'hit_ratio': (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0
+            }
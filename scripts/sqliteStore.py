@@ -0,0 +1,24 @@
+"""
+Thread-local SQLite connections for the SQLite-backed stores (planCache, reportJobs).
+"""
+import sqlite3
+import threading
+
+class ThreadLocalConnection:
+    """Callable returning this thread's connection to `path`, opened in WAL mode on first use.
+
+    sqlite3 connections cannot be shared across threads, so each thread opens its own.
+    """
+
+    def __init__(self, path, timeout=10):
+        self.path = path
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def __call__(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self.local.conn = conn
+        return conn
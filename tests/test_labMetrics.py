@@ -0,0 +1,72 @@
+from scripts import labMetrics
+
+def only_metric(text):
+    metrics, _ = labMetrics.extract_metrics(text)
+    assert len(metrics) == 1
+    return metrics[0]
+
+def test_grouped_digits_are_one_value():
+    metric = only_metric("Platelet Count 50,000 /cumm 1,50,000 - 4,50,000")
+    assert metric['name'] == "Platelets"
+    assert metric['value'] == 50000
+    assert metric['unit'] == "/cumm"
+    assert metric['reference_range'] == "150000 - 450000 /cumm"
+    assert metric['status'] == 'low'
+
+def test_grouped_digits_in_report_range():
+    metric = only_metric("Total WBC count 2,100 cells/cumm 4,000-11,000")
+    assert metric['value'] == 2100
+    assert metric['reference_range'] == "4000 - 11000 cells/cumm"
+    assert metric['status'] == 'low'
+
+def test_count_converted_to_table_unit():
+    metric = only_metric("Platelet Count 2,50,000 /cumm")
+    assert metric['value'] == 250
+    assert metric['unit'] == "10^3/uL"
+    assert metric['status'] == 'normal'
+
+def test_report_range_takes_precedence():
+    metric = only_metric("Hemoglobin 13.0 g/dL (13.5 - 17.5)")
+    assert metric['range_source'] == 'report'
+    assert metric['status'] == 'low'
+
+def test_table_range_with_unit_conversion():
+    metric = only_metric("Total Cholesterol 5.8 mmol/L")
+    assert metric['unit'] == "mg/dL"
+    assert metric['value'] == round(5.8 * 38.67, 2)
+    assert metric['status'] == 'high'
+
+def test_date_is_not_a_value():
+    metrics, remaining = labMetrics.extract_metrics("ALT test ordered on 12/03/2024")
+    assert metrics == []
+    assert remaining == "ALT test ordered on 12/03/2024"
+
+def test_repeated_analyte_line_is_kept():
+    metrics, remaining = labMetrics.extract_metrics("Hemoglobin 13.1 g/dL\nHemoglobin (repeat) 12 g/dL")
+    assert [metric['value'] for metric in metrics] == [13.1]
+    assert remaining == "Hemoglobin (repeat) 12 g/dL"
+
+def test_unknown_unit_line_is_kept():
+    metrics, remaining = labMetrics.extract_metrics("Sodium 140 mmol/L\nPotassium 4.1 furlongs")
+    assert [metric['status'] for metric in metrics] == ['normal', 'unknown']
+    assert remaining == "Potassium 4.1 furlongs"
+
+def test_random_glucose_is_not_flagged_against_fasting_range():
+    metric = only_metric("Random Blood Sugar 130 mg/dL")
+    assert metric['name'] == "Random Glucose"
+    assert metric['status'] == 'normal'
+    assert only_metric("Fasting Blood Sugar 130 mg/dL")['status'] == 'high'
+
+def test_unqualified_glucose_is_left_to_the_llm():
+    metrics, remaining = labMetrics.extract_metrics("Glucose 130 mg/dL")
+    assert metrics == []
+    assert remaining == "Glucose 130 mg/dL"
+
+def test_blood_pressure_split():
+    metrics, _ = labMetrics.extract_metrics("Blood pressure 142/91 mmHg")
+    assert [(metric['name'], metric['status']) for metric in metrics] == [
+        ("Systolic Blood Pressure", 'high'), ("Diastolic Blood Pressure", 'high')]
+
+def test_text_without_metrics_is_returned_unchanged():
+    text = "Patient reports mild fatigue.\nNo known allergies."
+    assert labMetrics.extract_metrics(text) == ([], text)